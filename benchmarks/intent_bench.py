@@ -0,0 +1,157 @@
+"""Measure intent/entity extraction accuracy and throughput on a message corpus.
+
+Runs every message in benchmarks/intent_corpus.json through detect_chat_intent,
+the rules /chat applies before deciding whether to call OpenAI, and checks the
+intent, the transfer details, the split of multi-action messages and the fast
+path decision (confidence >= INTENT_CONFIDENCE_THRESHOLD) against the expected
+values. Then times each stage of the rules over the whole corpus. Runs are
+appended to benchmarks/results/intent_bench.json.
+
+    python benchmarks/intent_bench.py
+    python benchmarks/intent_bench.py --repeat 2000 --min-accuracy 1.0 --verbose
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+CORPUS_PATH = os.path.join(BENCH_DIR, "intent_corpus.json")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results", "intent_bench.json")
+
+def load_service():
+    # Importing the service builds its clients and stores; none of them
+    # connect anywhere until a request comes in
+    os.environ.setdefault("OPENAI_API_KEY", "sk-intent-bench")
+    os.environ.setdefault("CONTEXT_BACKEND", "memory")
+    sys.path.insert(0, ROOT)
+    import langchain_service
+    return langchain_service
+
+def case_context(service, case: dict) -> dict:
+    return {**service.empty_context(), **case.get("context", {})}
+
+def check_case(service, case: dict) -> tuple:
+    """Mismatches between what the rules extract and what the corpus expects,
+    and whether the rules were confident enough to skip the LLM"""
+    metadata, confidence = service.detect_chat_intent(case["message"], case_context(service, case))
+    fast_path = confidence >= service.INTENT_CONFIDENCE_THRESHOLD
+    errors = []
+    if "actions" in case:
+        actions = metadata["actions"] if metadata["action"] == "multi_action" else []
+        if actions != case["actions"]:
+            errors.append(("actions", case["actions"], actions))
+        if "fast_path" in case and fast_path != case["fast_path"]:
+            errors.append(("fast_path", case["fast_path"], f"{fast_path} ({confidence})"))
+        return errors, fast_path
+
+    expected = case["expected"]
+    if metadata.get("action") != expected["action"]:
+        errors.append(("action", expected["action"], metadata.get("action")))
+    details = metadata.get("details") or {}
+    for field, value in (expected.get("details") or {}).items():
+        if details.get(field) != value:
+            errors.append((field, value, details.get(field)))
+    for field in ("proof_id", "proof_type"):
+        if metadata.get(field) != expected.get(field):
+            errors.append((field, expected.get(field), metadata.get(field)))
+    if fast_path != case["fast_path"]:
+        errors.append(("fast_path", case["fast_path"], f"{fast_path} ({confidence})"))
+    return errors, fast_path
+
+def measure_accuracy(service, corpus: list, verbose: bool) -> dict:
+    failed = 0
+    fields = {}
+    fast_path_taken = fast_path_wrong = 0
+    for case in corpus:
+        errors, fast_path = check_case(service, case)
+        failed += bool(errors)
+        for field, _, _ in errors:
+            fields[field] = fields.get(field, 0) + 1
+        if fast_path:
+            fast_path_taken += 1
+            # Skipping the LLM is only safe when the intent is right
+            fast_path_wrong += any(field != "fast_path" for field, _, _ in errors)
+        if errors and verbose:
+            print(f"  {case['message']!r}")
+            for field, expected, actual in errors:
+                print(f"    {field}: expected {expected!r}, got {actual!r}")
+    return {
+        "cases": len(corpus),
+        "failed": failed,
+        "accuracy": (len(corpus) - failed) / len(corpus),
+        "errors_by_field": fields,
+        "fast_path_taken": fast_path_taken,
+        "fast_path_precision": (fast_path_taken - fast_path_wrong) / fast_path_taken if fast_path_taken else None
+    }
+
+def measure_throughput(service, corpus: list, repeat: int) -> dict:
+    prepared = [(case["message"], case_context(service, case)) for case in corpus]
+    timings = {}
+    for name, run in (
+        ("extract_entities", lambda message, context: service.extract_entities(message)),
+        ("detect_intent", service.detect_intent),
+        ("parse_actions", service.parse_actions),
+        ("detect_chat_intent", service.detect_chat_intent)
+    ):
+        # Time each pass over the corpus and keep the median, so a noisy
+        # neighbour doesn't skew the comparison with earlier runs
+        passes = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for message, context in prepared:
+                run(message, context)
+            passes.append((time.perf_counter() - start) / len(prepared))
+        seconds = statistics.median(passes)
+        timings[name] = {"messages_per_sec": 1 / seconds, "us_per_message": seconds * 1e6}
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--repeat", type=int, default=500, help="Passes over the corpus when timing")
+    parser.add_argument("--min-accuracy", type=float, default=0.0, help="Exit with status 1 below this accuracy")
+    parser.add_argument("--verbose", action="store_true", help="Print every mismatch")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    options = parser.parse_args()
+
+    with open(options.corpus) as f:
+        corpus = json.load(f)
+    service = load_service()
+
+    accuracy = measure_accuracy(service, corpus, options.verbose)
+    throughput = measure_throughput(service, corpus, options.repeat)
+
+    print(f"\naccuracy: {accuracy['accuracy']:.1%} ({accuracy['cases'] - accuracy['failed']}/{accuracy['cases']} cases)")
+    for field, count in sorted(accuracy["errors_by_field"].items()):
+        print(f"  {field:>12}: {count} wrong")
+    if accuracy["fast_path_precision"] is not None:
+        print(f"fast path: {accuracy['fast_path_taken']} taken, {accuracy['fast_path_precision']:.1%} correct")
+    print(f"\n  {'stage':<18}  {'msg/s':>10}  {'us/msg':>8}")
+    for name, timing in throughput.items():
+        print(f"  {name:<18}  {timing['messages_per_sec']:>10.0f}  {timing['us_per_message']:>8.1f}")
+
+    results = []
+    if os.path.exists(options.output):
+        with open(options.output) as f:
+            results = json.load(f)
+    results.append({
+        "corpus": os.path.relpath(os.path.abspath(options.corpus), ROOT),
+        "repeat": options.repeat,
+        "accuracy": accuracy,
+        "throughput": throughput,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+    with open(options.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if accuracy["accuracy"] < options.min_accuracy:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""Offline load test for langchain_service.py.
+
+Starts the service with uvicorn against a local fake OpenAI server and the
+stub Circle handler in benchmarks/stubs/circleHandler.js (driven by the real
+executeTransfer.js and circleWorker.js), then drives /chat,
+/execute_direct_transfer, /execute_verified_transfer and
+/check_transfer_status at each concurrency level. Prints throughput, p50/p99
+latency and peak RSS of the service and its Node workers, appends the run to
+benchmarks/results/load_test.json and compares it with the previous run of
+the same configuration.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --scenarios chat,direct --concurrency 1,16,64 --requests 500
+    python benchmarks/load_test.py --circle-429-rate 0.2 --circle-422-rate 0.05 --env CIRCLE_WORKER_POOL_SIZE=0
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_PATH = os.path.join(BENCHMARKS_DIR, "results", "load_test.json")
+SCENARIOS = ("chat", "direct", "verified", "status")
+
+CHAT_MESSAGES = [
+    "Send 0.1 USDC to alice on solana",
+    "Prove KYC compliance",
+    "What is a zero-knowledge proof?",
+    "Do the same for bob on ethereum",
+    "Send 0.25 USDC to charlie if KYC compliant",
+    "Verify the last KYC proof",
+    "Prove location: NYC (40.7, -74.0)",
+    "How do transfers on Solana work?"
+]
+RECIPIENTS = ["alice", "bob", "charlie"]
+FAKE_REPLY = "Sure, I can help with that. The request is being processed by the zkEngine and Circle integration."
+
+# --- Fake OpenAI server ---
+
+async def handle_openai_connection(reader, writer, latency_secs: float, error_rate: float):
+    """Minimal HTTP/1.1 keep-alive server for POST /v1/chat/completions"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            await asyncio.sleep(latency_secs)
+
+            if random.random() < error_rate:
+                payload = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode()
+                writer.write(
+                    b"HTTP/1.1 429 Too Many Requests\r\nContent-Type: application/json\r\nretry-after-ms: 10\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                continue
+
+            request = json.loads(body or b"{}")
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            if request.get("stream"):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+                for word in FAKE_REPLY.split(" "):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": request.get("model", "fake"),
+                        "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]
+                    }
+                    writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                writer.write(b"data: [DONE]\n\n")
+                await writer.drain()
+                break
+
+            payload = json.dumps({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": FAKE_REPLY}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+            }).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_fake_openai(port: int, latency_secs: float, error_rate: float):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_openai_connection(reader, writer, latency_secs, error_rate),
+        "127.0.0.1", port
+    )
+    async with server:
+        await server.serve_forever()
+
+# --- Service under test ---
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def prepare_circle_dir(work_dir: str) -> str:
+    """Real worker/transfer scripts with the stub handler in place of circleHandler.js"""
+    circle_dir = os.path.join(work_dir, "circle")
+    os.makedirs(circle_dir)
+    for script in ("circleWorker.js", "executeTransfer.js"):
+        shutil.copy(os.path.join(REPO_DIR, "circle", script), circle_dir)
+    shutil.copy(os.path.join(BENCHMARKS_DIR, "stubs", "circleHandler.js"), circle_dir)
+    with open(os.path.join(circle_dir, "package.json"), "w") as f:
+        json.dump({"type": "module"}, f)
+    return circle_dir
+
+def service_env(options, work_dir: str, circle_dir: str, openai_port: int) -> dict:
+    env = os.environ.copy()
+    env.update({
+        "OPENAI_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "AGENTKIT_DIR": work_dir,
+        "CIRCLE_DIR": circle_dir,
+        "PROOFS_DIR": os.path.join(work_dir, "proofs"),
+        "CONTEXT_DB_PATH": os.path.join(work_dir, "context.db"),
+        "LLM_CACHE_PATH": "",
+        "TRANSFER_IDEMPOTENCY_PATH": os.path.join(work_dir, "transfer_idempotency.db"),
+        "PROOF_REGISTRY_PATH": os.path.join(work_dir, "proof_registry.db"),
+        "STUB_CIRCLE_LATENCY_MS": str(options.circle_latency_ms),
+        "STUB_CIRCLE_JITTER_MS": str(options.circle_jitter_ms),
+        "STUB_CIRCLE_429_RATE": str(options.circle_429_rate),
+        "STUB_CIRCLE_422_RATE": str(options.circle_422_rate)
+    })
+    for override in options.env:
+        name, _, value = override.partition("=")
+        env[name] = value
+    return env
+
+def start_process(argv: list, env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(argv, env=env, cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_until_ready(client: httpx.AsyncClient, process: subprocess.Popen, log_path: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path) as f:
+                raise SystemExit(f"Service exited during startup:\n{f.read()[-2000:]}")
+        try:
+            if (await client.get("/context")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"Service did not start within {timeout:g}s, see {log_path}")
+
+def process_tree_rss_mb(pid: int) -> float:
+    """Resident memory of a process and its descendants (Linux /proc)"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [child for child, ppid in parents.items() if ppid == parent and child not in tree]
+        tree.update(children)
+        frontier.extend(children)
+
+    rss_kb = 0
+    for member in tree:
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return rss_kb / 1024
+
+# --- Load driver ---
+
+def build_request(scenario: str, index: int, run_id: str, transfer_ids: list) -> tuple:
+    if scenario == "chat":
+        return "/chat", {
+            "message": CHAT_MESSAGES[index % len(CHAT_MESSAGES)],
+            "session_id": f"load-{index % 32}"
+        }
+    details = {
+        "amount": "0.1",
+        "recipient": RECIPIENTS[index % len(RECIPIENTS)],
+        "blockchain": "SOL" if index % 2 else "ETH"
+    }
+    if scenario == "direct":
+        return "/execute_direct_transfer", details
+    if scenario == "verified":
+        return "/execute_verified_transfer", {
+            "transfer_details": details,
+            "proof_id": f"load_{run_id}_{index}",
+            "transfer_request_id": uuid.uuid4().hex
+        }
+    # Poll the transfers created earlier in the run, several times each
+    transfer_id = transfer_ids[index % len(transfer_ids)] if transfer_ids else f"stub-0-{index % 64}"
+    return "/check_transfer_status", {"transferId": transfer_id}
+
+def is_error_payload(data) -> bool:
+    return isinstance(data, dict) and ("error" in data or data.get("success") is False)
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+async def run_scenario(client: httpx.AsyncClient, service_pid: int, scenario: str, concurrency: int,
+                       total: int, run_id: str, transfer_ids: list) -> dict:
+    latencies = []
+    status_codes = {}
+    errors = 0
+    peak_rss_mb = process_tree_rss_mb(service_pid)
+    indexes = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        # Workers share one iterator, so each request index is sent once
+        for index in indexes:
+            path, body = build_request(scenario, index, run_id, transfer_ids)
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                code = str(response.status_code)
+                data = response.json() if response.status_code == 200 else None
+            except (httpx.HTTPError, ValueError) as e:
+                code, data = type(e).__name__, None
+            latencies.append(time.perf_counter() - start)
+            status_codes[code] = status_codes.get(code, 0) + 1
+            if data is None or is_error_payload(data):
+                errors += 1
+            elif scenario in ("direct", "verified") and data.get("transferId"):
+                transfer_ids.append(data["transferId"])
+
+    async def sample_rss():
+        nonlocal peak_rss_mb
+        while True:
+            await asyncio.sleep(0.25)
+            peak_rss_mb = max(peak_rss_mb, process_tree_rss_mb(service_pid))
+
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+
+    latencies.sort()
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "status_codes": status_codes,
+        "elapsed_secs": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "peak_rss_mb": round(peak_rss_mb, 1)
+    }
+
+def stage_summary(metrics_text: str) -> dict:
+    """Mean seconds and count per stage from the service's /metrics"""
+    totals = {}
+    for line in metrics_text.splitlines():
+        if not line.startswith(("agentkit_stage_duration_seconds_sum", "agentkit_stage_duration_seconds_count")):
+            continue
+        series, value = line.rsplit(" ", 1)
+        stage = series.split('stage="', 1)[1].split('"', 1)[0]
+        entry = totals.setdefault(stage, {"sum": 0.0, "count": 0})
+        if series.startswith("agentkit_stage_duration_seconds_sum"):
+            entry["sum"] += float(value)
+        else:
+            entry["count"] += int(float(value))
+    return {
+        stage: {"count": entry["count"], "mean_ms": round(entry["sum"] / entry["count"] * 1000, 3) if entry["count"] else 0.0}
+        for stage, entry in sorted(totals.items())
+    }
+
+def print_results(results: list, previous: dict):
+    print(f"\n  {'scenario':<10} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'rss MB':>8}  vs previous")
+    for result in results:
+        baseline = previous.get((result["scenario"], result["concurrency"]))
+        delta = ""
+        if baseline:
+            throughput = (result["throughput_rps"] / baseline["throughput_rps"] - 1) * 100 if baseline["throughput_rps"] else 0
+            p99 = (result["p99_ms"] / baseline["p99_ms"] - 1) * 100 if baseline["p99_ms"] else 0
+            delta = f"req/s {throughput:+.1f}%  p99 {p99:+.1f}%"
+        print(
+            f"  {result['scenario']:<10} {result['concurrency']:>5} {result['throughput_rps']:>9.1f} "
+            f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>7} {result['peak_rss_mb']:>8.1f}  {delta}"
+        )
+
+async def run_load_test(options, config: dict) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    circle_dir = prepare_circle_dir(work_dir)
+    openai_port, service_port = free_port(), free_port()
+
+    openai_server = start_process(
+        [sys.executable, os.path.abspath(__file__), "--fake-openai", str(openai_port),
+         "--openai-latency-ms", str(options.openai_latency_ms), "--openai-429-rate", str(options.openai_429_rate)],
+        os.environ.copy(),
+        os.path.join(work_dir, "fake_openai.log")
+    )
+    service_log = os.path.join(work_dir, "service.log")
+    service = start_process(
+        [sys.executable, "-m", "uvicorn", "langchain_service:app", "--app-dir", REPO_DIR,
+         "--host", "127.0.0.1", "--port", str(service_port), "--workers", str(options.workers), "--log-level", "warning"],
+        service_env(options, work_dir, circle_dir, openai_port),
+        service_log
+    )
+
+    run_id = uuid.uuid4().hex[:8]
+    results = []
+    stages = {}
+    limits = httpx.Limits(max_connections=max(options.concurrency), max_keepalive_connections=max(options.concurrency))
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{service_port}", timeout=options.timeout, limits=limits) as client:
+            await wait_until_ready(client, service, service_log)
+            transfer_ids = []
+            for scenario in options.scenarios:
+                for concurrency in options.concurrency:
+                    result = await run_scenario(client, service.pid, scenario, concurrency, options.requests, run_id, transfer_ids)
+                    results.append(result)
+                    print(f"{scenario} x{concurrency}: {result['throughput_rps']:.1f} req/s, p99 {result['p99_ms']:.1f} ms, {result['errors']} errors")
+            if options.workers == 1:
+                stages = stage_summary((await client.get("/metrics")).text)
+    finally:
+        for process in (service, openai_server):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if options.keep_logs:
+            print(f"Logs kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "label": options.label,
+        "config": config,
+        "results": results,
+        "stages": stages
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency level")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (>1 needs --env CONTEXT_BACKEND=sqlite)")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--openai-latency-ms", type=float, default=300)
+    parser.add_argument("--openai-429-rate", type=float, default=0.0)
+    parser.add_argument("--circle-latency-ms", type=float, default=150)
+    parser.add_argument("--circle-jitter-ms", type=float, default=50)
+    parser.add_argument("--circle-429-rate", type=float, default=0.0)
+    parser.add_argument("--circle-422-rate", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="Extra service environment, repeatable")
+    parser.add_argument("--label", default="", help="Free-form note stored with the run")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--keep-logs", action="store_true", help="Keep the service and fake OpenAI logs")
+    parser.add_argument("--fake-openai", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.fake_openai:
+        asyncio.run(serve_fake_openai(options.fake_openai, options.openai_latency_ms / 1000, options.openai_429_rate))
+        return
+
+    options.scenarios = [scenario for scenario in options.scenarios.split(",") if scenario]
+    unknown = set(options.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    options.concurrency = [int(level) for level in options.concurrency.split(",")]
+
+    # Runs are only compared with runs of the same configuration
+    config = {
+        name: getattr(options, name) for name in (
+            "scenarios", "concurrency", "requests", "workers", "openai_latency_ms", "openai_429_rate",
+            "circle_latency_ms", "circle_jitter_ms", "circle_429_rate", "circle_422_rate", "env"
+        )
+    }
+
+    history = []
+    if os.path.exists(options.output):
+        with open(options.output) as f:
+            history = json.load(f)
+    previous = next((run for run in reversed(history) if run["config"] == config), None)
+
+    run = asyncio.run(run_load_test(options, config))
+    print_results(run["results"], {
+        (result["scenario"], result["concurrency"]): result for result in (previous or {}).get("results", [])
+    })
+    if run["stages"]:
+        print("\n  stage means: " + ", ".join(f"{stage} {entry['mean_ms']:.2f} ms" for stage, entry in run["stages"].items()))
+
+    history.append(run)
+    os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+    with open(options.output, "w") as f:
+        json.dump(history, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Measure zkEngine proof time and size across step sizes.
+
+Runs `zkEngine prove` the same way src/main.rs does for every WASM and step
+size, prints the time/size trade-off curve per WASM, and appends the runs to
+benchmarks/results/step_size.json. The step_size planner in
+langchain_service.py keys its samples by WASM name and argument shape, so by
+default every proof function is swept with the WASM and arguments /chat
+generates it with; --wasm sweeps other files with --args.
+
+    python benchmarks/step_size_sweep.py --steps 10,25,50,100,200
+    python benchmarks/step_size_sweep.py --wasm zkengine/example_wasms/prove_kyc.wasm --args 1 --repeat 3
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "step_size.json")
+
+# Must match PROOF_WASM_FILES and PROOF_ARGUMENTS in langchain_service.py
+PROOF_FUNCTIONS = {
+    "prove_kyc": ("prove_kyc.wasm", ["1"]),
+    "prove_ai_content": ("prove_ai_content.wasm", ["content_hash", "openai"]),
+    "prove_location": ("prove_location.wasm", ["12345"])
+}
+
+def run_proof(zkengine: str, wasm_path: str, step_size: int, arguments: list, timeout: float) -> dict:
+    out_dir = tempfile.mkdtemp(prefix="step_sweep_")
+    try:
+        command = [zkengine, "prove", "--wasm", wasm_path, "--out-dir", out_dir, "--step", str(step_size)] + arguments
+        start = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+        elapsed = time.perf_counter() - start
+        proof_path = os.path.join(out_dir, "proof.bin")
+        complete = result.returncode == 0 and os.path.exists(proof_path)
+        return {
+            "wasm_path": os.path.abspath(wasm_path),
+            "arguments": arguments,
+            "step_size": step_size,
+            "status": "complete" if complete else "failed",
+            "generation_time_secs": elapsed,
+            "file_size_mb": os.path.getsize(proof_path) / (1024 * 1024) if complete else None,
+            "error": None if complete else (result.stderr or result.stdout)[-500:],
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+    except subprocess.TimeoutExpired:
+        return {
+            "wasm_path": os.path.abspath(wasm_path),
+            "arguments": arguments,
+            "step_size": step_size,
+            "status": "timeout",
+            "generation_time_secs": timeout,
+            "file_size_mb": None,
+            "error": f"Timed out after {timeout}s",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def print_curve(wasm_path: str, runs: list):
+    print(f"\n{os.path.basename(wasm_path)}")
+    print(f"  {'step':>6}  {'runs':>4}  {'time (s)':>10}  {'size (MB)':>10}")
+    for step_size in sorted({run["step_size"] for run in runs}):
+        complete = [run for run in runs if run["step_size"] == step_size and run["status"] == "complete"]
+        if not complete:
+            print(f"  {step_size:>6}  {0:>4}  {'failed':>10}  {'-':>10}")
+            continue
+        seconds = sorted(run["generation_time_secs"] for run in complete)[len(complete) // 2]
+        megabytes = sorted(run["file_size_mb"] for run in complete)[len(complete) // 2]
+        print(f"  {step_size:>6}  {len(complete):>4}  {seconds:>10.2f}  {megabytes:>10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--zkengine", default=os.getenv("ZKENGINE_BINARY", "./zkengine_binary/zkEngine"))
+    parser.add_argument("--wasm-dir", default=os.getenv("WASM_DIR", "./zkengine/example_wasms"))
+    parser.add_argument("--wasm", action="append", help="WASM file to sweep (default: the WASM of every proof function)")
+    parser.add_argument("--args", nargs="*", default=[], help="Arguments passed to every --wasm proof")
+    parser.add_argument("--steps", default="10,25,50,100,200", help="Comma separated step sizes")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per WASM and step size")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    options = parser.parse_args()
+
+    if options.wasm:
+        targets = [(wasm_path, options.args) for wasm_path in options.wasm]
+    else:
+        targets = [
+            (os.path.join(options.wasm_dir, wasm_file), arguments)
+            for wasm_file, arguments in PROOF_FUNCTIONS.values()
+        ]
+    step_sizes = [int(step) for step in options.steps.split(",")]
+
+    results = []
+    if os.path.exists(options.output):
+        with open(options.output) as f:
+            results = json.load(f)
+
+    for wasm_path, arguments in targets:
+        runs = []
+        for step_size in step_sizes:
+            for _ in range(options.repeat):
+                run = run_proof(options.zkengine, wasm_path, step_size, arguments, options.timeout)
+                runs.append(run)
+                print(f"{os.path.basename(wasm_path)} step={step_size}: {run['status']} {run['generation_time_secs']:.2f}s")
+        print_curve(wasm_path, runs)
+        results.extend(runs)
+
+        # Save after every WASM so an interrupted sweep keeps its results
+        os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+// circleHandler.js stand-in for benchmarks/load_test.py
+//
+// Same interface as circle/circleHandler.js, without the Circle API: every
+// call sleeps STUB_CIRCLE_LATENCY_MS (+/- STUB_CIRCLE_JITTER_MS) and fails
+// with a 429 or 422 at STUB_CIRCLE_429_RATE / STUB_CIRCLE_422_RATE. Transfers
+// stay pending for STUB_CIRCLE_SETTLE_MS before their status is complete.
+import crypto from 'crypto';
+
+const LATENCY_MS = Number(process.env.STUB_CIRCLE_LATENCY_MS || 50);
+const JITTER_MS = Number(process.env.STUB_CIRCLE_JITTER_MS || 0);
+const RATE_429 = Number(process.env.STUB_CIRCLE_429_RATE || 0);
+const RATE_422 = Number(process.env.STUB_CIRCLE_422_RATE || 0);
+const SETTLE_MS = Number(process.env.STUB_CIRCLE_SETTLE_MS || 2000);
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, Math.max(0, ms)));
+}
+
+async function simulateCall({ validate = false } = {}) {
+    await sleep(LATENCY_MS + (Math.random() * 2 - 1) * JITTER_MS);
+    const roll = Math.random();
+    if (roll < RATE_429) {
+        throw new Error('Request failed with status code 429');
+    }
+    if (validate && roll < RATE_429 + RATE_422) {
+        throw new Error('Transfer failed: Request failed with status code 422');
+    }
+}
+
+export default class CircleUSDCHandler {
+    constructor() {
+        this.initialized = false;
+        this.transferHistory = [];
+        this.ethWalletAddress = '0x82a26a6d847e7e0961ab432b9a5a209e0db41040';
+        this.solWalletAddress = 'HsZdbBxZVNzEn4qR9Ebx5XxDSZ136Mu14VlH1nbXGhfG';
+    }
+
+    async initialize() {
+        this.initialized = true;
+        return true;
+    }
+
+    // History lives in memory only; the load test doesn't need it shared
+    loadTransferHistory() {}
+
+    async transferUSDC(amount, recipientAddress, isKYCVerified = false, blockchain = 'ETH', idempotencyKey = crypto.randomUUID()) {
+        const previous = this.transferHistory.find(t => t.idempotencyKey === idempotencyKey);
+        if (previous) {
+            return { success: true, ...previous };
+        }
+
+        await simulateCall({ validate: true });
+
+        // The creation time is part of the id so any process can tell when it settles
+        const transferId = `stub-${Date.now()}-${crypto.randomUUID()}`;
+        const transfer = {
+            id: transferId,
+            transferId: transferId,
+            circleTransferId: transferId,
+            transactionHash: 'pending',
+            amount: amount.toString(),
+            recipient: recipientAddress,
+            from: blockchain === 'SOL' ? this.solWalletAddress : this.ethWalletAddress,
+            blockchain: blockchain,
+            status: 'pending',
+            isKYCVerified: isKYCVerified,
+            idempotencyKey: idempotencyKey
+        };
+        this.transferHistory.push(transfer);
+        return { success: true, ...transfer };
+    }
+
+    async getTransferStatusReport(transferId) {
+        try {
+            await simulateCall();
+        } catch (error) {
+            return { success: false, status: 'rate_limited', error: error.message };
+        }
+
+        const createdAt = Number((transferId.match(/^stub-(\d+)-/) || [])[1] || 0);
+        const complete = Date.now() - createdAt >= SETTLE_MS;
+        return {
+            success: true,
+            status: complete ? 'complete' : 'pending',
+            transactionHash: complete ? '0x' + crypto.createHash('sha256').update(transferId).digest('hex') : 'pending',
+            transferId: transferId,
+            blockchain: 'ETH'
+        };
+    }
+}
+
+if (import.meta.url === `file://${process.argv[1]}`) {
+    const handler = new CircleUSDCHandler();
+    handler.getTransferStatusReport(process.argv[2] || '').then(report => {
+        console.log(JSON.stringify(report));
+    });
+}
@@ -100,9 +100,23 @@ class CircleUSDCHandler {
         }
     }
 
-    async transferUSDC(amount, recipientAddress, isKYCVerified = false, blockchain = 'ETH') {
+    async transferUSDC(amount, recipientAddress, isKYCVerified = false, blockchain = 'ETH', idempotencyKey = uuidv4()) {
         if (!this.initialized) await this.initialize();
 
+        // A retried request with the same idempotency key returns the original transfer
+        const previous = this.transferHistory.find(t => t.idempotencyKey === idempotencyKey);
+        if (previous) {
+            console.log(`♻️ Transfer already initiated for idempotency key ${idempotencyKey}: ${previous.id}`);
+            const txHash = previous.transactionHash || 'pending';
+            return {
+                success: true,
+                ...previous,
+                transactionHash: txHash,
+                hash: txHash,
+                txHash: txHash
+            };
+        }
+
         console.log(`💸 Initiating ${amount} USDC transfer to ${recipientAddress} on ${blockchain}`);
         
         // Simulation mode for when Circle API is not available
@@ -122,6 +136,7 @@ class CircleUSDCHandler {
                 status: 'complete',
                 timestamp: new Date().toISOString(),
                 isKYCVerified: isKYCVerified,
+                idempotencyKey: idempotencyKey,
                 simulated: true
             };
             
@@ -138,7 +153,6 @@ class CircleUSDCHandler {
         
         // Real Circle API transfer
         const sourceWalletId = blockchain === 'SOL' ? this.solWalletId : this.ethWalletId;
-        const idempotencyKey = uuidv4();
         
         try {
             // Create transfer request
@@ -320,6 +334,29 @@ class CircleUSDCHandler {
         }
     }
 
+    async getTransferStatusReport(transferId) {
+        // Status payload shared by the CLI below and circleWorker.js
+        try {
+            const transferDetails = await this.getTransferDetails(transferId);
+            return {
+                success: true,
+                status: transferDetails.status || 'unknown',
+                transactionHash: transferDetails.transactionHash || 'pending',
+                transferId: transferDetails.id || transferId,
+                blockchain: transferDetails.blockchain || 'ETH',
+                amount: transferDetails.amount,
+                recipient: transferDetails.recipient,
+                from: transferDetails.from
+            };
+        } catch (error) {
+            return {
+                success: false,
+                status: error.message.includes('429') ? 'rate_limited' : 'error',
+                error: error.message
+            };
+        }
+    }
+
     async getTransactionStatus(transferId) {
         try {
             const transfer = await this.getTransferDetails(transferId);
@@ -356,61 +393,7 @@ if (import.meta.url === `file://${process.argv[1]}`) {
     
     const handler = new CircleUSDCHandler();
     handler.initialize().then(async () => {
-        try {
-            const transferDetails = await handler.getTransferDetails(transferId);
-            console.log(JSON.stringify({
-                success: true,
-                status: transferDetails.status || 'unknown',
-                transactionHash: transferDetails.transactionHash || 'pending',
-                transferId: transferDetails.id || transferId,
-                blockchain: transferDetails.blockchain || 'ETH',
-                amount: transferDetails.amount,
-                recipient: transferDetails.recipient,
-                from: transferDetails.from
-            }));
-        } catch (error) {
-            console.log(JSON.stringify({
-                success: false,
-                status: error.message.includes('429') ? 'rate_limited' : 'error',
-                error: error.message
-            }));
-        }
-        process.exit(0);
-    });
-}
-
-// CLI interface for checking transfer status
-if (import.meta.url === `file://${process.argv[1]}`) {
-    const transferId = process.argv[2];
-    if (!transferId) {
-        console.log(JSON.stringify({
-            success: false,
-            error: 'No transfer ID provided'
-        }));
-        process.exit(1);
-    }
-    
-    const handler = new CircleUSDCHandler();
-    handler.initialize().then(async () => {
-        try {
-            const transferDetails = await handler.getTransferDetails(transferId);
-            console.log(JSON.stringify({
-                success: true,
-                status: transferDetails.status || 'unknown',
-                transactionHash: transferDetails.transactionHash || 'pending',
-                transferId: transferDetails.id || transferId,
-                blockchain: transferDetails.blockchain || 'ETH',
-                amount: transferDetails.amount,
-                recipient: transferDetails.recipient,
-                from: transferDetails.from
-            }));
-        } catch (error) {
-            console.log(JSON.stringify({
-                success: false,
-                status: error.message.includes('429') ? 'rate_limited' : 'error',
-                error: error.message
-            }));
-        }
+        console.log(JSON.stringify(await handler.getTransferStatusReport(transferId)));
         process.exit(0);
     });
 }
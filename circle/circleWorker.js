@@ -0,0 +1,74 @@
+#!/usr/bin/env node
+// circleWorker.js - Long-lived Circle worker driven by langchain_service.py
+//
+// Protocol: one JSON request per line on stdin, one JSON response per line on stdout.
+//   {"id": "...", "op": "transfer", "args": ["send", "0.1", "USDC", "to", "alice"], "idempotencyKey": "..."}
+//   {"id": "...", "op": "status", "transferId": "..."}
+// Responses mirror what the CLI scripts print, plus the exit code they would return:
+//   {"id": "...", "exitCode": 0, "output": {...}}
+import readline from 'readline';
+import CircleUSDCHandler from './circleHandler.js';
+import { executeTransfer } from './executeTransfer.js';
+
+// stdout is reserved for protocol messages, so route handler logging to stderr
+const writeStdout = process.stdout.write.bind(process.stdout);
+console.log = (...args) => console.error(...args);
+
+const handler = new CircleUSDCHandler();
+const ready = handler.initialize();
+
+function respond(message) {
+    writeStdout(JSON.stringify(message) + '\n');
+}
+
+async function handleRequest(request) {
+    await ready;
+
+    // Other workers share transfer_history.json, so pick up their writes
+    // before reading or appending to it
+    handler.loadTransferHistory();
+
+    if (request.op === 'transfer') {
+        const command = (request.args || []).join(' ');
+        console.error(`🎯 Processing: ${command}`);
+        try {
+            const output = await executeTransfer(handler, command, request.idempotencyKey);
+            return { exitCode: 0, output };
+        } catch (error) {
+            console.error(`❌ Error: ${error.message}`);
+            return { exitCode: 1, output: { success: false, error: error.message } };
+        }
+    }
+
+    if (request.op === 'status') {
+        if (!request.transferId) {
+            return { exitCode: 1, output: { success: false, error: 'No transfer ID provided' } };
+        }
+        return { exitCode: 0, output: await handler.getTransferStatusReport(request.transferId) };
+    }
+
+    return { exitCode: 1, output: { success: false, error: `Unknown op: ${request.op}` } };
+}
+
+const input = readline.createInterface({ input: process.stdin });
+
+input.on('line', async (line) => {
+    if (!line.trim()) return;
+
+    let request;
+    try {
+        request = JSON.parse(line);
+    } catch (error) {
+        console.error(`❌ Invalid worker request: ${line}`);
+        return;
+    }
+
+    try {
+        respond({ id: request.id, ...(await handleRequest(request)) });
+    } catch (error) {
+        respond({ id: request.id, exitCode: 1, output: { success: false, error: error.message } });
+    }
+});
+
+// Parent closed our stdin: shut down cleanly
+input.on('close', () => process.exit(0));
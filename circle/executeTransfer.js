@@ -1,7 +1,7 @@
 #!/usr/bin/env node
 import CircleUSDCHandler from './circleHandler.js';
 
-const TEST_ADDRESSES = {
+export const TEST_ADDRESSES = {
     "alice": "0x70997970C51812dc3A010C7d01b50e0d17dc79C8",
     "alice_solana": "7UX2i7SucgLMQcfZ75s3VXmZZY4YRUyJN9X1RgfMoDUi",
     "bob": "0x3C44CdDdB6a900fa2b585dd299e03d12FA4293BC",
@@ -10,74 +10,88 @@ const TEST_ADDRESSES = {
     "charlie_solana": "2sWRYvL8M4S9XPvKNfUdy2Qvn6LYaXjqXDvMv9KsxbUa"
 };
 
-async function main() {
+/**
+ * Execute a transfer described by a CLI-style command, e.g.
+ * "send 0.1 USDC to alice on solana". Shared by the CLI and circleWorker.js.
+ */
+export async function executeTransfer(handler, command, idempotencyKey) {
     // Detect if this is a KYC transfer based on command
-    const command = process.argv.slice(2).join(' ');
     const isKYCTransfer = command.includes('KYC') || command.includes('kyc') || command.includes('verified');
+    
+    const lowerCommand = command.toLowerCase();
+    
+    // Parse amount
+    const amountMatch = command.match(/(\d+(?:\.\d+)?)/);
+    const amount = amountMatch ? parseFloat(amountMatch[1]) : 0.1;
+    
+    // Parse recipient
+    let recipientMatch = command.match(/to ([a-zA-Z]+|0x[a-fA-F0-9]{40}|[1-9A-HJ-NP-Za-km-z]{32,44})/);
+    let recipient = recipientMatch ? recipientMatch[1] : 'alice';
+    
+    // Determine blockchain
+    let blockchain = 'ETH';
+    let recipientAddress = recipient;
+    
+    const isSolanaRequested = lowerCommand.includes('solana') || lowerCommand.includes(' sol');
+    
+    // Resolve test addresses
+    const recipientLower = recipient.toLowerCase();
+    if (TEST_ADDRESSES[recipientLower]) {
+        if (isSolanaRequested && TEST_ADDRESSES[`${recipientLower}_solana`]) {
+            recipientAddress = TEST_ADDRESSES[`${recipientLower}_solana`];
+            blockchain = 'SOL';
+        } else {
+            recipientAddress = TEST_ADDRESSES[recipientLower];
+        }
+    } else {
+        // Check address format
+        if (recipient.match(/^[1-9A-HJ-NP-Za-km-z]{32,44}$/)) {
+            blockchain = 'SOL';
+        }
+        if (isSolanaRequested) {
+            blockchain = 'SOL';
+        }
+    }
+    
+    const result = await handler.transferUSDC(amount, recipientAddress, isKYCTransfer, blockchain, idempotencyKey);
+    
+    // Clean JSON response
+    const response = {
+        success: true,
+        transactionId: result.transactionHash || result.id || 'pending',
+        transactionHash: result.transactionHash || result.id || 'pending',
+        transferId: result.transferId || result.id,
+        circleTransferId: result.circleTransferId || result.id,
+        message: `Transferred ${amount} USDC to ${recipientAddress} on ${blockchain}`,
+        amount: amount.toString(),
+        recipient: recipientAddress,
+        from: result.from,
+        blockchain: blockchain
+    };
+    
+    if (result.simulated) {
+        response.simulated = true;
+    }
+    
+    return response;
+}
 
+async function main() {
     try {
-        const command = process.argv.slice(2).join(' ');
+        // Optional "--idempotency-key <uuid>" so retries don't send twice
+        const argv = process.argv.slice(2);
+        const keyIndex = argv.indexOf('--idempotency-key');
+        const idempotencyKey = keyIndex >= 0 ? argv.splice(keyIndex, 2)[1] : undefined;
+        const command = argv.join(' ');
         console.error(`🎯 Processing: ${command}`);
         
-        const lowerCommand = command.toLowerCase();
-        
-        // Parse amount
-        const amountMatch = command.match(/(\d+(?:\.\d+)?)/);
-        const amount = amountMatch ? parseFloat(amountMatch[1]) : 0.1;
-        
-        // Parse recipient
-        let recipientMatch = command.match(/to ([a-zA-Z]+|0x[a-fA-F0-9]{40}|[1-9A-HJ-NP-Za-km-z]{32,44})/);
-        let recipient = recipientMatch ? recipientMatch[1] : 'alice';
-        
-        // Determine blockchain
-        let blockchain = 'ETH';
-        let recipientAddress = recipient;
-        
-        const isSolanaRequested = lowerCommand.includes('solana') || lowerCommand.includes(' sol');
-        
-        // Resolve test addresses
-        const recipientLower = recipient.toLowerCase();
-        if (TEST_ADDRESSES[recipientLower]) {
-            if (isSolanaRequested && TEST_ADDRESSES[`${recipientLower}_solana`]) {
-                recipientAddress = TEST_ADDRESSES[`${recipientLower}_solana`];
-                blockchain = 'SOL';
-            } else {
-                recipientAddress = TEST_ADDRESSES[recipientLower];
-            }
-        } else {
-            // Check address format
-            if (recipient.match(/^[1-9A-HJ-NP-Za-km-z]{32,44}$/)) {
-                blockchain = 'SOL';
-            }
-            if (isSolanaRequested) {
-                blockchain = 'SOL';
-            }
-        }
-        
         // Initialize handler and execute transfer
         const handler = new CircleUSDCHandler();
         await handler.initialize();
         
-        const result = await handler.transferUSDC(amount, recipientAddress, isKYCTransfer, blockchain);
+        const response = await executeTransfer(handler, command, idempotencyKey);
         
         // Output clean JSON response
-        const response = {
-            success: true,
-            transactionId: result.transactionHash || result.id || 'pending',
-            transactionHash: result.transactionHash || result.id || 'pending',
-            transferId: result.transferId || result.id,
-            circleTransferId: result.circleTransferId || result.id,
-            message: `Transferred ${amount} USDC to ${recipientAddress} on ${blockchain}`,
-            amount: amount.toString(),
-            recipient: recipientAddress,
-            from: result.from,
-            blockchain: blockchain
-        };
-        
-        if (result.simulated) {
-            response.simulated = true;
-        }
-        
         console.log(JSON.stringify(response));
         
     } catch (error) {
@@ -90,4 +104,6 @@ async function main() {
     }
 }
 
-main();
+if (import.meta.url === `file://${process.argv[1]}`) {
+    main();
+}
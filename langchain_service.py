@@ -1,13 +1,30 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from openai import OpenAI
+from openai import AsyncOpenAI, APITimeoutError
+import asyncio
+import bisect
+import httpx
 import os
-import subprocess
+import shutil
+import statistics
 import json
+import math
 import re
-from typing import Dict, Any, Optional
-from datetime import datetime
+import fcntl
+import hashlib
+import sqlite3
+import struct
+import tempfile
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from multiprocessing import shared_memory
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -24,104 +41,2755 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize OpenAI client with API key
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# --- Metrics ---
 
-# In-memory storage for conversation context
-conversation_context = {
-    "last_transfer": None,
-    "last_proof_type": None,
-    "conversation_history": []
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+STAGE_METRIC = "agentkit_stage_duration_seconds"
+
+# Labels for whatever the current request is doing; asyncio tasks inherit them
+metrics_endpoint: ContextVar[str] = ContextVar("metrics_endpoint", default="none")
+metrics_blockchain: ContextVar[str] = ContextVar("metrics_blockchain", default="none")
+
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """Counters and latency histograms, rendered in Prometheus text format.
+
+    An update is a dict lookup and a couple of adds on the event loop thread,
+    cheap enough for every request. Each uvicorn worker keeps its own numbers.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        # Per-bucket counts, then +Inf, then the sum of observed values
+        self.histograms: Dict[Tuple[str, tuple], list] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, str]) -> Tuple[str, tuple]:
+        labels.setdefault("endpoint", metrics_endpoint.get())
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{name}="{escape_label(value)}"' for name, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines = []
+        for metric in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE {metric} counter")
+            for (name, labels), value in sorted(self.counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{self._labels(labels)} {value:g}")
+        
+        for metric in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {metric} histogram")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), histogram):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{metric}_bucket{self._labels(labels, le)} {cumulative}")
+                lines.append(f"{metric}_sum{self._labels(labels)} {histogram[-1]:.6f}")
+                lines.append(f"{metric}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics(METRICS_BUCKETS)
+
+def observe_stage(stage: str, seconds: float):
+    metrics.observe(STAGE_METRIC, seconds, stage=stage, blockchain=metrics_blockchain.get())
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a block as one stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+class MetricsMiddleware:
+    """Times every HTTP request and labels everything it does with its route"""
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = None
+
+    def _endpoint(self, path: str) -> str:
+        # Route templates, not raw paths, so ids don't explode label cardinality
+        if self.routes is None:
+            self.routes = [(route.path_regex, route.path) for route in app.routes if hasattr(route, "path_regex")]
+        for path_regex, template in self.routes:
+            if path_regex.match(path):
+                return template
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        endpoint = self._endpoint(scope["path"])
+        metrics_endpoint.set(endpoint)
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.observe(
+                "agentkit_http_request_duration_seconds",
+                time.perf_counter() - start,
+                endpoint=endpoint,
+                method=scope["method"],
+                status=str(status)
+            )
+
+app.add_middleware(MetricsMiddleware)
+
+# --- Admission Control ---
+
+class DependencyOverloaded(HTTPException):
+    """A dependency's queue is full or the wait for it ran past its deadline"""
+
+    def __init__(self, dependency: str, reason: str, retry_after_secs: int):
+        super().__init__(
+            status_code=503,
+            detail=f"{dependency} is overloaded ({reason}), retry in {retry_after_secs}s",
+            headers={"Retry-After": str(retry_after_secs)}
+        )
+        self.dependency = dependency
+        self.reason = reason
+
+class DependencyLimiter:
+    """Concurrency limit with a bounded FIFO queue and a queue-time deadline.
+
+    Requests beyond `max_concurrency` wait in line; when `max_queue` are
+    already waiting, or a request waits longer than `queue_timeout_secs`, it
+    fails fast with a 503 instead of piling more work onto a dependency that
+    is already behind. Retry-After is estimated from recent slot hold times.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout_secs: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_secs = queue_timeout_secs
+        self.active = 0
+        self.waiters: deque = deque()
+        self.hold_secs = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def saturated(self) -> bool:
+        """A new request would be rejected right now"""
+        return self.active >= self.max_concurrency and len(self.waiters) >= self.max_queue
+
+    def retry_after(self) -> int:
+        backlog = len(self.waiters) + 1
+        return max(1, min(60, int(self.hold_secs * backlog / self.max_concurrency + 0.999)))
+
+    def _reject(self, reason: str):
+        metrics.inc("agentkit_admission_rejected_total", dependency=self.name, reason=reason)
+        raise DependencyOverloaded(self.name, reason, self.retry_after())
+
+    async def acquire(self):
+        if self.active < self.max_concurrency and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            self._reject("queue full")
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        queued = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout_secs)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # The slot was handed over just as we gave up; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            self._reject("queue timeout")
+        finally:
+            observe_stage(f"{self.name}_queue", time.perf_counter() - queued)
+        self.admitted += 1
+
+    def release(self):
+        # Hand the slot straight to the next waiter so newcomers can't jump the queue
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.hold_secs += 0.2 * (time.perf_counter() - start - self.hold_secs)
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout_secs": self.queue_timeout_secs,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_hold_secs": round(self.hold_secs, 3)
+        }
+
+# OpenAI settings
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_TIMEOUT_SECS = float(os.getenv("OPENAI_TIMEOUT_SECS", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "64"))
+OPENAI_MAX_QUEUE = int(os.getenv("OPENAI_MAX_QUEUE", "128"))
+OPENAI_QUEUE_TIMEOUT_SECS = float(os.getenv("OPENAI_QUEUE_TIMEOUT_SECS", "10"))
+
+# Initialize async OpenAI client with API key. All /chat calls share one
+# pooled HTTP client, so keep-alive connections are reused across requests.
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    timeout=OPENAI_TIMEOUT_SECS,
+    max_retries=OPENAI_MAX_RETRIES,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONCURRENCY,
+            max_keepalive_connections=OPENAI_MAX_CONCURRENCY
+        ),
+        timeout=OPENAI_TIMEOUT_SECS
+    )
+)
+
+# Bounds in-flight and queued OpenAI calls per worker
+openai_limiter = DependencyLimiter("openai", OPENAI_MAX_CONCURRENCY, OPENAI_MAX_QUEUE, OPENAI_QUEUE_TIMEOUT_SECS)
+
+# --- Conversation Context ---
+
+CONTEXT_BACKEND = os.getenv("CONTEXT_BACKEND", "memory")
+CONTEXT_HISTORY_LIMIT = int(os.getenv("CONTEXT_HISTORY_LIMIT", "50"))
+CONTEXT_MAX_SESSIONS = int(os.getenv("CONTEXT_MAX_SESSIONS", "1000"))
+CONTEXT_SESSION_TTL_SECS = float(os.getenv("CONTEXT_SESSION_TTL_SECS", "3600"))
+CONTEXT_MAX_BYTES = int(os.getenv("CONTEXT_MAX_BYTES", str(16 * 1024 * 1024)))
+CONTEXT_DB_PATH = os.getenv("CONTEXT_DB_PATH", "context.db")
+CONTEXT_SHM_NAME = os.getenv("CONTEXT_SHM_NAME", "agentkit_context")
+DEFAULT_SESSION_ID = "default"
+
+def message_size(message: Dict[str, Any]) -> int:
+    """Approximate memory cost of a history entry"""
+    return len(json.dumps(message, default=str))
+
+def empty_context() -> Dict[str, Any]:
+    return {
+        "last_transfer": None,
+        "last_proof_type": None,
+        "conversation_history": []
+    }
+
+class ContextBackend:
+    """Storage for per-session conversation context.
+
+    Every backend keeps the last transfer, the last proof type and the most
+    recent CONTEXT_HISTORY_LIMIT messages per session, drops sessions idle for
+    longer than CONTEXT_SESSION_TTL_SECS, and evicts least recently used
+    sessions to stay within CONTEXT_MAX_SESSIONS and CONTEXT_MAX_BYTES.
+    Only the sqlite and shm backends can be shared between worker processes.
+    """
+
+    shared = False
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def update(self, session_id: str, **fields):
+        """Set last_transfer and/or last_proof_type for a session"""
+        raise NotImplementedError
+
+    def add_message(self, session_id: str, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    def reset(self, session_id: str):
+        raise NotImplementedError
+
+    def snapshot(self, session_id: str) -> Dict[str, Any]:
+        context = self.get(session_id)
+        return {
+            "session_id": session_id,
+            "last_transfer": context["last_transfer"],
+            "last_proof_type": context["last_proof_type"],
+            "conversation_history": list(context["conversation_history"])
+        }
+
+class MemoryContextBackend(ContextBackend):
+    """Process-local sessions kept in access order for LRU/TTL eviction"""
+
+    def __init__(self, max_sessions: int, ttl_secs: float, max_bytes: int):
+        self.max_sessions = max_sessions
+        self.ttl_secs = ttl_secs
+        self.max_bytes = max_bytes
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+
+    def _drop(self, session_id: str):
+        session = self.sessions.pop(session_id)
+        self.total_bytes -= session["bytes"]
+
+    def _evict(self, keep: str):
+        # Sessions are kept in access order, so idle ones are at the front
+        now = time.monotonic()
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session_id == keep or now - session["last_seen"] <= self.ttl_secs:
+                break
+            self._drop(session_id)
+        
+        while len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes:
+            session_id = next(iter(self.sessions))
+            if session_id == keep:
+                break
+            self._drop(session_id)
+        
+        # The active session alone is over the memory cap: trim its history
+        session = self.sessions.get(keep)
+        while session and self.total_bytes > self.max_bytes and session["conversation_history"]:
+            dropped = message_size(session["conversation_history"].popleft())
+            session["bytes"] -= dropped
+            self.total_bytes -= dropped
+
+    def _touch(self, session_id: str) -> Dict[str, Any]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = {
+                **empty_context(),
+                "conversation_history": deque(maxlen=CONTEXT_HISTORY_LIMIT),
+                "bytes": 0
+            }
+        else:
+            self.sessions.move_to_end(session_id)
+        session["last_seen"] = time.monotonic()
+        self._evict(keep=session_id)
+        return session
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        if session_id not in self.sessions:
+            return empty_context()
+        return self._touch(session_id)
+
+    def update(self, session_id: str, **fields):
+        self._touch(session_id).update(fields)
+
+    def add_message(self, session_id: str, message: Dict[str, Any]):
+        session = self._touch(session_id)
+        history = session["conversation_history"]
+        if len(history) == history.maxlen:
+            dropped = message_size(history[0])
+            session["bytes"] -= dropped
+            self.total_bytes -= dropped
+        history.append(message)
+        size = message_size(message)
+        session["bytes"] += size
+        self.total_bytes += size
+        self._evict(keep=session_id)
+
+    def reset(self, session_id: str):
+        if session_id in self.sessions:
+            self._drop(session_id)
+
+class SQLiteContextBackend(ContextBackend):
+    """Sessions in a SQLite database (WAL mode) shared by all workers on a host"""
+
+    shared = True
+    EVICT_INTERVAL_SECS = 1.0
+
+    def __init__(self, path: str, max_sessions: int, ttl_secs: float, max_bytes: int):
+        self.max_sessions = max_sessions
+        self.ttl_secs = ttl_secs
+        self.max_bytes = max_bytes
+        self.last_evict = 0.0
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_transfer TEXT,
+                last_proof_type TEXT,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+        """)
+
+    def _touch(self, session_id: str):
+        self.conn.execute(
+            "INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET last_seen = excluded.last_seen",
+            (session_id, time.time())
+        )
+
+    def _evict(self):
+        # Eviction scans the whole table, so run it at most once per interval
+        now = time.time()
+        if now - self.last_evict < self.EVICT_INTERVAL_SECS:
+            return
+        self.last_evict = now
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.ttl_secs,))
+            self.conn.execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                "SELECT session_id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            )
+            self.conn.execute("DELETE FROM messages WHERE session_id NOT IN (SELECT session_id FROM sessions)")
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+            if total > self.max_bytes:
+                # Drop the oldest messages across all sessions until under the cap
+                self.conn.execute(
+                    "DELETE FROM messages WHERE id IN ("
+                    "SELECT id FROM (SELECT id, SUM(size) OVER (ORDER BY id DESC) AS running FROM messages) "
+                    "WHERE running > ?)",
+                    (self.max_bytes,)
+                )
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        row = self.conn.execute(
+            "SELECT last_transfer, last_proof_type FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return empty_context()
+        history = [
+            json.loads(body) for (body,) in self.conn.execute(
+                "SELECT body FROM messages WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            )
+        ]
+        return {
+            "last_transfer": json.loads(row[0]) if row[0] else None,
+            "last_proof_type": row[1],
+            "conversation_history": history
+        }
+
+    def update(self, session_id: str, **fields):
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._touch(session_id)
+            if "last_transfer" in fields:
+                self.conn.execute(
+                    "UPDATE sessions SET last_transfer = ? WHERE session_id = ?",
+                    (json.dumps(fields["last_transfer"]), session_id)
+                )
+            if "last_proof_type" in fields:
+                self.conn.execute(
+                    "UPDATE sessions SET last_proof_type = ? WHERE session_id = ?",
+                    (fields["last_proof_type"], session_id)
+                )
+        self._evict()
+
+    def add_message(self, session_id: str, message: Dict[str, Any]):
+        body = json.dumps(message, default=str)
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._touch(session_id)
+            self.conn.execute(
+                "INSERT INTO messages (session_id, body, size) VALUES (?, ?, ?)",
+                (session_id, body, len(body))
+            )
+            # Keep only the newest CONTEXT_HISTORY_LIMIT messages for the session
+            self.conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN ("
+                "SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, CONTEXT_HISTORY_LIMIT)
+            )
+        self._evict()
+
+    def reset(self, session_id: str):
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+class SharedMemoryContextBackend(ContextBackend):
+    """Sessions in a fixed-size shared memory table shared by all workers.
+
+    The segment holds CONTEXT_MAX_SESSIONS slots of CONTEXT_MAX_BYTES /
+    CONTEXT_MAX_SESSIONS bytes. A session lives in the slot picked by a stable
+    hash of its id, so a colliding session evicts the previous occupant, and
+    its history is trimmed from the oldest message until it fits the slot.
+    Writers serialize on an flock'ed lock file.
+    """
+
+    shared = True
+    HEADER = struct.Struct("<I")
+
+    def __init__(self, name: str, max_sessions: int, ttl_secs: float, max_bytes: int):
+        self.slots = max_sessions
+        self.slot_size = max_bytes // max_sessions
+        self.ttl_secs = ttl_secs
+        size = self.slots * self.slot_size
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Another worker (or the launcher) already created the table
+            self.shm = shared_memory.SharedMemory(name=name)
+            if self.shm.size < size:
+                raise RuntimeError(f"Shared memory segment {name} is smaller than {size} bytes")
+        self.lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a")
+
+    def close(self):
+        self.shm.close()
+        self.lock_file.close()
+
+    def _slot(self, session_id: str) -> int:
+        digest = hashlib.blake2b(session_id.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.slots * self.slot_size
+
+    def _read(self, session_id: str) -> Optional[Dict[str, Any]]:
+        offset = self._slot(session_id)
+        (length,) = self.HEADER.unpack_from(self.shm.buf, offset)
+        if length == 0:
+            return None
+        start = offset + self.HEADER.size
+        entry = json.loads(bytes(self.shm.buf[start:start + length]))
+        if entry["session_id"] != session_id or time.time() - entry["last_seen"] > self.ttl_secs:
+            return None
+        return entry
+
+    def _write(self, entry: Dict[str, Any]):
+        entry["last_seen"] = time.time()
+        capacity = self.slot_size - self.HEADER.size
+        data = json.dumps(entry, default=str).encode()
+        while len(data) > capacity and entry["conversation_history"]:
+            entry["conversation_history"].pop(0)
+            data = json.dumps(entry, default=str).encode()
+        if len(data) > capacity:
+            print(f"Context for session {entry['session_id']} does not fit a {self.slot_size} byte slot")
+            return
+        offset = self._slot(entry["session_id"])
+        self.shm.buf[offset + self.HEADER.size:offset + self.HEADER.size + len(data)] = data
+        self.HEADER.pack_into(self.shm.buf, offset, len(data))
+
+    def _modify(self, session_id: str, change):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            entry = self._read(session_id) or {"session_id": session_id, **empty_context()}
+            change(entry)
+            self._write(entry)
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+        try:
+            entry = self._read(session_id)
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        return entry or empty_context()
+
+    def update(self, session_id: str, **fields):
+        self._modify(session_id, lambda entry: entry.update(fields))
+
+    def add_message(self, session_id: str, message: Dict[str, Any]):
+        def append(entry):
+            history = entry["conversation_history"]
+            history.append(message)
+            del history[:-CONTEXT_HISTORY_LIMIT]
+        self._modify(session_id, append)
+
+    def reset(self, session_id: str):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            if self._read(session_id) is not None:
+                self.HEADER.pack_into(self.shm.buf, self._slot(session_id), 0)
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+def create_context_backend(kind: str) -> ContextBackend:
+    if kind == "sqlite":
+        return SQLiteContextBackend(CONTEXT_DB_PATH, CONTEXT_MAX_SESSIONS, CONTEXT_SESSION_TTL_SECS, CONTEXT_MAX_BYTES)
+    if kind == "shm":
+        return SharedMemoryContextBackend(CONTEXT_SHM_NAME, CONTEXT_MAX_SESSIONS, CONTEXT_SESSION_TTL_SECS, CONTEXT_MAX_BYTES)
+    if kind != "memory":
+        raise ValueError(f"Unknown CONTEXT_BACKEND: {kind}")
+    return MemoryContextBackend(CONTEXT_MAX_SESSIONS, CONTEXT_SESSION_TTL_SECS, CONTEXT_MAX_BYTES)
+
+conversation_store = create_context_backend(CONTEXT_BACKEND)
+
+class ChatRequest(BaseModel):
+    message: str
+    session_id: str = DEFAULT_SESSION_ID
+    mode: Optional[str] = None
+
+class ChatResponse(BaseModel):
+    response: str
+    metadata: dict
+
+# --- Entity Extraction ---
+
+# Names circle/executeTransfer.js resolves from TEST_ADDRESSES, with the
+# chains each one has an address on
+ADDRESS_BOOK = {
+    "alice": ("ETH", "SOL"),
+    "bob": ("ETH", "SOL"),
+    "charlie": ("ETH", "SOL")
+}
+DEFAULT_RECIPIENT = "alice"
+ETH_ADDRESS_PATTERN = re.compile(r"0x[0-9a-fA-F]{40}")
+SOL_ADDRESS_PATTERN = re.compile(r"[1-9A-HJ-NP-Za-km-z]{32,44}")
+CHAIN_ALIASES = {"ethereum": "ETH", "eth": "ETH", "sepolia": "ETH", "solana": "SOL", "sol": "SOL"}
+PROOF_TYPE_WORDS = {"ai": "prove_ai_content", "content": "prove_ai_content", "location": "prove_location", "kyc": "prove_kyc"}
+NON_RECIPIENT_WORDS = {
+    "the", "me", "both", "each", "them", "it", "kyc", "usdc", "ethereum", "solana",
+    "send", "transfer", "pay", "prove", "verify", "make", "do", "check",
+    "please", "thanks", "thank", "thx"
 }
 
-class ChatRequest(BaseModel):
-    message: str
+# One compiled scan splits a message into tokens: proof UUIDs and amounts
+# (".5", "1,000", "-5") stay whole, addresses are plain words.
+# extract_entities then reads them in a single pass using the tables below
+TOKEN_PATTERN = re.compile(
+    r"-?(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\.\d+)|-\d+(?:\.\d+)?"
+    r"|\w+(?:(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}|\.\d+)?|\?",
+    re.IGNORECASE
+)
+AMOUNT_TOKEN_PATTERN = re.compile(r"-?(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)")
+# "1USDC" scans as one word; a decimal like "1.5USDC" already splits after the digits
+GLUED_AMOUNT_PATTERN = re.compile(r"(\d+)usdc")
+WORD_KINDS = {
+    **{word: "transfer" for word in ("send", "sends", "sending", "transfer", "transfers", "transferring", "pay")},
+    **{word: "prove" for word in ("prove", "proves", "proving")},
+    **{word: "verify" for word in ("verify", "verifying")},
+    **{word: "proof" for word in ("proof", "proofs")},
+    **{word: "chain" for word in CHAIN_ALIASES},
+    **{word: "proof_type" for word in PROOF_TYPE_WORDS},
+    **{word: "name" for word in ADDRESS_BOOK},
+    **{word: "follow_up" for word in ("do", "same", "now", "repeat")},
+    **{word: "all_chains" for word in ("both", "all")},
+    # "don't" and "doesn't" scan as "don", "t"
+    **{word: "negation" for word in ("not", "never", "dont", "t")},
+    "to": "to",
+    "usdc": "usdc",
+    "?": "question"
+}
+QUESTION_WORDS = {"how", "what", "why", "which", "when", "where", "should", "is", "are", "does"}
+# Phrases that repeat the last transfer, keyed by their first word
+FOLLOW_UP_PHRASES = {
+    "do": [("do", "the", "same")],
+    "same": [("same", "transfer"), ("same", "thing")],
+    "now": [("now", "on"), ("now", "do", "it", "on")],
+    "repeat": [("repeat",)]
+}
+ALL_CHAINS_WORDS = {"chains", "networks", "blockchains"}
+
+class MessageEntities(NamedTuple):
+    question: bool
+    negated: bool
+    follow_up: bool
+    transfer: bool
+    prove: bool
+    verify: bool
+    proof: bool
+    amount: Optional[str]
+    recipient: Optional[str]
+    recipient_known: bool
+    chains: Tuple[str, ...]
+    proof_types: Tuple[str, ...]
+    proof_id: Optional[str]
+
+def address_chain(recipient: str) -> Optional[str]:
+    """The only chain an address recipient can receive on; None for address book names"""
+    if ETH_ADDRESS_PATTERN.fullmatch(recipient):
+        return "ETH"
+    if SOL_ADDRESS_PATTERN.fullmatch(recipient):
+        return "SOL"
+    return None
+
+def resolve_recipient(token: str) -> Tuple[str, bool]:
+    """Canonical recipient and whether the Circle scripts know how to pay it.
+
+    Names are lowercased; addresses keep their case (Solana's base58 is
+    case-sensitive).
+    """
+    name = token.lower()
+    if name in ADDRESS_BOOK:
+        return name, True
+    if len(token) >= 32 and address_chain(token):
+        return token, True
+    return name, False
+
+def extract_entities(message: str) -> MessageEntities:
+    """Scan a message once for everything detect_intent and parse_actions look at"""
+    tokens = TOKEN_PATTERN.findall(message)
+    words = [token.lower() for token in tokens]
+    flags = set()
+    amount = proof_id = None
+    chains = []
+    proof_types = []
+    # (explicit "to <word>", position, token); the transfer verb's position
+    # tells a recipient from the "to" in "I want to send"
+    candidates = []
+    transfer_at = -1
+    negation_seen = False
+    
+    if words and words[0] in QUESTION_WORDS:
+        flags.add("question")
+    for index, word in enumerate(words):
+        kind = WORD_KINDS.get(word)
+        if kind is None:
+            # Most words carry nothing; proof ids and addresses are the rest
+            # (a leading "-" is a negative amount, not a proof id)
+            if word.startswith("proof_") or "-" in word[1:]:
+                proof_id = proof_id or tokens[index]
+                flags.add("proof")
+            elif len(word) >= 32 and address_chain(tokens[index]):
+                candidates.append((False, index, tokens[index]))
+            elif amount is None and word.endswith("usdc"):
+                glued = GLUED_AMOUNT_PATTERN.fullmatch(word)
+                if glued:
+                    amount = glued.group(1)
+        elif kind == "chain":
+            chains.append(CHAIN_ALIASES[word])
+        elif kind == "proof_type":
+            proof_types.append(PROOF_TYPE_WORDS[word])
+        elif kind == "name":
+            candidates.append((False, index, word))
+        elif kind == "to":
+            if index + 1 < len(words):
+                candidates.append((True, index + 1, tokens[index + 1]))
+        elif kind == "usdc":
+            if amount is None and index and AMOUNT_TOKEN_PATTERN.fullmatch(words[index - 1]):
+                amount = words[index - 1].replace(",", "")
+        elif kind == "follow_up":
+            if any(tuple(words[index:index + len(phrase)]) == phrase for phrase in FOLLOW_UP_PHRASES[word]):
+                flags.add("follow_up")
+        elif kind == "all_chains":
+            if index + 1 < len(words) and words[index + 1] in ALL_CHAINS_WORDS:
+                chains.extend(("ETH", "SOL"))
+        elif kind == "negation":
+            negation_seen = True
+        else:
+            if kind == "transfer" and transfer_at < 0:
+                transfer_at = index
+            # "don't send ..." names an action without asking for it
+            if negation_seen and kind in ("transfer", "prove", "verify"):
+                flags.add("negated")
+            flags.add(kind)
+    
+    # Address book names and addresses first, "to" before a bare mention;
+    # otherwise the first unknown word after "to" that follows the verb
+    recipient, recipient_known = None, False
+    for explicit, position, token in candidates:
+        resolved, known = resolve_recipient(token)
+        if known:
+            if explicit:
+                recipient, recipient_known = resolved, True
+                break
+            if not recipient_known:
+                recipient, recipient_known = resolved, True
+        elif explicit and recipient is None and position > transfer_at and resolved not in NON_RECIPIENT_WORDS:
+            recipient = resolved
+    
+    return MessageEntities(
+        question="question" in flags,
+        negated="negated" in flags,
+        follow_up="follow_up" in flags,
+        transfer="transfer" in flags,
+        prove="prove" in flags,
+        verify="verify" in flags,
+        proof="proof" in flags,
+        amount=amount,
+        recipient=recipient,
+        recipient_known=recipient_known,
+        chains=tuple(dict.fromkeys(chains)),
+        proof_types=tuple(dict.fromkeys(proof_types)),
+        proof_id=proof_id
+    )
+
+def extract_transfer_details(message: str, context: Dict[str, Any],
+                             entities: Optional[MessageEntities] = None) -> Dict[str, str]:
+    """Extract transfer details from message with context awareness"""
+    entities = entities or extract_entities(message)
+    
+    # "do the same on solana" repeats the last transfer on another chain
+    if entities.follow_up and entities.chains and context.get("last_transfer"):
+        previous = context["last_transfer"]
+        return {
+            "amount": previous["amount"],
+            "recipient": previous["recipient"],
+            "blockchain": entities.chains[0]
+        }
+    
+    # USDC only has 2 decimal places
+    amount = normalize_amount(entities.amount)
+    recipient = entities.recipient or DEFAULT_RECIPIENT
+    blockchain = address_chain(recipient) or ("SOL" if "SOL" in entities.chains else "ETH")
+    if recipient in ADDRESS_BOOK and blockchain not in ADDRESS_BOOK[recipient]:
+        blockchain = ADDRESS_BOOK[recipient][0]
+    
+    return {
+        "amount": amount,
+        "recipient": recipient,
+        "blockchain": blockchain
+    }
+
+# --- Intent Rules ---
+
+# llm: always ask OpenAI; fast: skip OpenAI when the rules are confident;
+# rules: never call OpenAI
+CHAT_MODES = ("llm", "fast", "rules")
+CHAT_MODE = os.getenv("CHAT_MODE", "llm")
+if CHAT_MODE not in CHAT_MODES:
+    raise ValueError(f"Unknown CHAT_MODE: {CHAT_MODE}")
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.85"))
+
+def transfer_confidence(amount: Optional[str], recipient: Optional[str], recipient_known: bool) -> float:
+    """Amount and recipient fall back to defaults when missing, so only trust
+    fully specified transfers; a name outside the address book is left for
+    the LLM to question, and so is a zero or negative amount"""
+    if amount is not None and float(amount) <= 0:
+        return 0.0
+    confidence = 0.5
+    if amount:
+        confidence += 0.25
+    if recipient:
+        confidence += 0.2 if recipient_known else 0.05
+    return confidence
+
+def detect_intent(message: str, context: Dict[str, Any],
+                  entities: Optional[MessageEntities] = None) -> Tuple[Dict[str, Any], float]:
+    """Keyword/regex intent detection with a confidence score in [0, 1]"""
+    entities = entities or extract_entities(message)
+    metadata = {"action": "none"}
+    confidence = 0.0
+    
+    # Check for context-aware commands first
+    if entities.follow_up:
+        if context["last_transfer"] and entities.chains:
+            if context["last_proof_type"] in ("kyc_transfer", "direct_transfer"):
+                metadata = {
+                    "action": context["last_proof_type"],
+                    "details": extract_transfer_details(message, context, entities)
+                }
+                confidence = 0.9
+    
+    # Standard intent detection
+    elif entities.transfer:
+        action = "kyc_transfer" if "prove_kyc" in entities.proof_types else "direct_transfer"
+        metadata = {
+            "action": action,
+            "details": extract_transfer_details(message, context, entities)
+        }
+        confidence = transfer_confidence(entities.amount, entities.recipient, entities.recipient_known)
+            
+    elif entities.prove:
+        if entities.proof_types:
+            metadata = {"action": entities.proof_types[0]}
+            # Several proof types in one message are ambiguous
+            confidence = 0.9 if len(entities.proof_types) == 1 else 0.5
+            
+    elif entities.verify and entities.proof:
+        metadata = {"action": "verify_proof"}
+        if entities.proof_id:
+            metadata["proof_id"] = entities.proof_id
+        elif entities.proof_types:
+            metadata["proof_type"] = entities.proof_types[0]
+        confidence = 0.85
+    
+    # Questions about an action, or negated ones, are not requests to run it
+    if entities.question or entities.negated:
+        confidence = max(0.0, confidence - 0.5)
+    
+    return metadata, round(confidence, 2)
+
+CHAIN_NAMES = {"ETH": "Ethereum", "SOL": "Solana"}
+
+def describe_intent(metadata: Dict[str, Any]) -> str:
+    """Canned assistant text used when the LLM is skipped"""
+    action = metadata.get("action")
+    details = metadata.get("details") or {}
+    chain = CHAIN_NAMES.get(details.get("blockchain"), details.get("blockchain"))
+    if action == "multi_action":
+        return " ".join(describe_intent(sub_metadata) for sub_metadata in metadata["actions"])
+    if action == "kyc_transfer":
+        return (f"Generating a KYC compliance proof, then sending {details['amount']} USDC "
+                f"to {details['recipient']} on {chain} once it verifies.")
+    if action == "direct_transfer":
+        return f"Sending {details['amount']} USDC to {details['recipient']} on {chain}."
+    if action == "prove_kyc":
+        return "Generating a KYC compliance proof."
+    if action == "prove_ai_content":
+        return "Generating an AI content verification proof."
+    if action == "prove_location":
+        return "Generating a location verification proof."
+    if action == "verify_proof":
+        return "Verifying the proof."
+    return ("I can generate KYC, AI content and location proofs, verify proofs, "
+            "and send USDC on Ethereum or Solana. What would you like to do?")
+
+# --- Multi-Action Parsing ---
+
+MAX_ACTIONS_PER_MESSAGE = int(os.getenv("MAX_ACTIONS_PER_MESSAGE", "10"))
+TRANSFER_ACTIONS = ("kyc_transfer", "direct_transfer")
+PROOF_ACTIONS = tuple(dict.fromkeys(PROOF_TYPE_WORDS.values()))
+
+# Cheap pre-check so single-action messages skip clause parsing
+MULTI_ACTION_HINT = re.compile(r"[,;&]|\.(?=\s|$)|\b(?:and|then|both|all)\b", re.IGNORECASE)
+# Clause boundaries: ";", a sentence end, "then", or "and"/"," before a new
+# verb or amount ("and 2 USDC to bob", "and bob 2 USDC")
+CLAUSE_SPLIT_PATTERN = re.compile(
+    r"\s*(?:;|\.(?=\s|$)|,?\s*\b(?:and\s+)?then\b"
+    r"|,?\s*\band\s+(?=(?:send|transfer|pay|prove|verify)\b|(?:\w+\s+)?\d+(?:\.\d+)?\s*usdc\b)"
+    r"|,\s*(?=(?:send|transfer|pay|prove|verify)\b))\s*",
+    re.IGNORECASE
+)
+RECIPIENT_LIST_PATTERN = re.compile(r"\bto\s+(.+?)(?=\s+(?:if|with|for|once)\b|[.!?]*$)", re.IGNORECASE)
+RECIPIENT_SEPARATOR_PATTERN = re.compile(r"\s*(?:,|&|\band\b)\s*", re.IGNORECASE)
+CHAIN_PREPOSITIONS = {"on", "via", "using", "over"}
+
+def parse_recipients(text: str) -> Tuple[Optional[list], bool]:
+    """(recipient, chains) for each recipient listed after "to", and whether
+    every name in the list resolved to a known recipient.
+
+    Chains pair with the recipient they follow: "to alice on solana and bob
+    on ethereum" is alice on SOL and bob on ETH. Chains after the last
+    recipient only ("to alice and bob on ethereum and solana") apply to the
+    whole list. The recipients are None when part of the list can't be read,
+    e.g. "to alice and 2 to bob", "to alice and also to bob" or "to alice on
+    solana and bob".
+    """
+    match = RECIPIENT_LIST_PATTERN.search(text)
+    if not match:
+        return [], True
+    recipients = []
+    all_known = True
+    for index, part in enumerate(RECIPIENT_SEPARATOR_PATTERN.split(match.group(1))):
+        words = [word.strip(".,!?") for word in part.split()]
+        # "to both alice and bob"
+        if words and words[0].lower() in ("both", "each"):
+            words = words[1:]
+        if not words:
+            continue
+        lowered = [word.lower() for word in words]
+        # "... on ethereum and solana": another chain for the recipient before
+        if lowered[0] in CHAIN_PREPOSITIONS:
+            lowered = lowered[1:]
+        if lowered and lowered[0] in CHAIN_ALIASES:
+            if recipients:
+                recipients[-1][1].append(CHAIN_ALIASES[lowered[0]])
+            continue
+        if lowered[0] in NON_RECIPIENT_WORDS:
+            continue
+        recipient, known = resolve_recipient(words[0])
+        chains = []
+        if len(lowered) > 2 and lowered[1] in CHAIN_PREPOSITIONS and lowered[2] in CHAIN_ALIASES:
+            chains.append(CHAIN_ALIASES[lowered[2]])
+        if not known:
+            # "and 2 to bob" or "and also to bob" is another transfer, not prose
+            if "to" in lowered or any(AMOUNT_TOKEN_PATTERN.fullmatch(word) for word in lowered):
+                return None, False
+            # Unknown names must stand alone: "to bob, it's rent" is one recipient
+            if len(words) > 1 or not recipient.isalnum():
+                continue
+            # and only count as the first word after "to"; a trailing one like
+            # "dave" in "to bob and dave" is dropped but leaves the list in doubt
+            all_known = False
+            if index:
+                continue
+        if all(recipient != listed for listed, _ in recipients):
+            recipients.append((recipient, chains))
+    
+    with_chains = [index for index, (_, chains) in enumerate(recipients) if chains]
+    if with_chains == [len(recipients) - 1]:
+        shared = recipients[-1][1]
+        recipients = [(recipient, shared) for recipient, _ in recipients]
+    elif len(with_chains) not in (0, len(recipients)):
+        # "to alice on solana and bob": bob's chain is anyone's guess
+        return None, False
+    return [(recipient, tuple(dict.fromkeys(chains))) for recipient, chains in recipients], all_known
+
+def parse_actions(message: str, context: Dict[str, Any],
+                  entities: Optional[MessageEntities] = None) -> Tuple[list, float]:
+    """Split a message into one intent metadata dict per action.
+
+    "send 1 USDC to alice and bob on ethereum and solana" becomes four
+    transfers (recipients x chains), "send 1 USDC to alice on solana and bob
+    on ethereum" two, and "prove kyc and location" two proofs. Each clause
+    goes through detect_intent; lists of recipients, chains and proof types
+    then fan out. Messages with a single action return at most one entry, so
+    callers can keep the single-intent path for them.
+
+    Also returns the confidence of the least certain recipient list: a name
+    outside the address book, or a trailing name that was dropped, scores the
+    transfers like an unknown recipient would. A recipient list that can't be
+    read returns no actions, leaving the single intent of the message, with
+    that same low confidence.
+    """
+    if not MULTI_ACTION_HINT.search(message):
+        return [], 1.0
+    
+    message_entities = entities or extract_entities(message)
+    kyc_required = "prove_kyc" in message_entities.proof_types
+    actions = []
+    previous_action = None
+    confidence = 1.0
+    
+    for clause in CLAUSE_SPLIT_PATTERN.split(message):
+        if not clause.strip():
+            continue
+        entities = message_entities if clause == message else extract_entities(clause)
+        # "... and 2 USDC to bob" continues the previous transfer
+        if previous_action in TRANSFER_ACTIONS and not entities.transfer and entities.amount:
+            entities = entities._replace(transfer=True)
+        metadata, _ = detect_intent(clause, context, entities)
+        action = metadata["action"]
+        
+        if action in TRANSFER_ACTIONS:
+            details = metadata["details"]
+            if not entities.amount and previous_action in TRANSFER_ACTIONS:
+                details["amount"] = actions[-1]["details"]["amount"]
+            # "... if KYC compliant" anywhere applies to every transfer, but a
+            # follow-up keeps the kind of the transfer it repeats
+            if kyc_required and not entities.follow_up:
+                action = "kyc_transfer"
+            chains = list(entities.chains or message_entities.chains) or [details["blockchain"]]
+            recipients, all_known = parse_recipients(clause)
+            if recipients is None:
+                return [], transfer_confidence(message_entities.amount, details["recipient"], False)
+            if recipients:
+                confidence = min(confidence, transfer_confidence(message_entities.amount, recipients[0][0], all_known))
+            elif not entities.recipient and not entities.follow_up:
+                # "... and dave 2 USDC": nobody the rules know, so the default recipient would be paid
+                confidence = min(confidence, transfer_confidence(message_entities.amount, None, False))
+            for recipient, recipient_chains in recipients or [(details["recipient"], ())]:
+                fixed_chain = address_chain(recipient)
+                for blockchain in [fixed_chain] if fixed_chain else (recipient_chains or chains):
+                    actions.append({
+                        "action": action,
+                        "details": {**details, "recipient": recipient, "blockchain": blockchain}
+                    })
+        elif action in PROOF_ACTIONS:
+            # A KYC transfer already generates the KYC proof
+            skip_kyc = kyc_required and message_entities.transfer
+            actions.extend(
+                {"action": proof_type} for proof_type in entities.proof_types
+                if not (proof_type == "prove_kyc" and skip_kyc)
+            )
+        elif action != "none":
+            actions.append(metadata)
+        previous_action = action if action != "none" else previous_action
+    
+    unique = []
+    for metadata in actions:
+        if metadata not in unique:
+            unique.append(metadata)
+    return unique[:MAX_ACTIONS_PER_MESSAGE], round(confidence, 2)
+
+def detect_chat_intent(message: str, context: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+    """detect_intent for a chat turn, as multi_action metadata when the
+    message asks for several things; the message is only scanned once and
+    the confidence is that of the least certain action"""
+    entities = extract_entities(message)
+    metadata, confidence = detect_intent(message, context, entities)
+    actions, actions_confidence = parse_actions(message, context, entities)
+    if len(actions) > 1:
+        metadata = {"action": "multi_action", "actions": actions}
+    return metadata, min(confidence, actions_confidence)
+
+# --- LLM Response Cache ---
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL_SECS = float(os.getenv("LLM_CACHE_TTL_SECS", "3600"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+
+def normalize_message(message: str) -> str:
+    """Case, whitespace and trailing punctuation don't change the answer"""
+    return " ".join(message.lower().split()).rstrip(".!")
+
+class ResponseCache:
+    """LRU + TTL cache of completions, with an optional SQLite tier on disk.
+
+    Keys hash the model, the normalized user message and the context lines
+    that go into the prompt, so a cached answer is only reused for a prompt
+    the model would have seen identically.
+    """
+
+    def __init__(self, max_entries: int, ttl_secs: float, path: str = ""):
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.path = path
+        self.db = None
+
+    def open(self):
+        """Open the disk tier; called from startup so importing the module creates no files"""
+        if not self.path or self.db:
+            return
+        self.db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.db.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_secs,))
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(message: str, context_info: str) -> str:
+        raw = "\x00".join([OPENAI_MODEL, normalize_message(message), context_info])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _remember(self, key: str, response: str, created: float):
+        self.entries[key] = (response, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry and now - entry[1] <= self.ttl_secs:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if entry:
+            del self.entries[key]
+        
+        if self.db:
+            row = self.db.execute(
+                "SELECT response, created FROM llm_cache WHERE key = ? AND created >= ?",
+                (key, now - self.ttl_secs)
+            ).fetchone()
+            if row:
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[0]
+        
+        self.misses += 1
+        return None
+
+    def put(self, key: str, response: str):
+        created = time.time()
+        self._remember(key, response, created)
+        if self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created) VALUES (?, ?, ?)",
+                (key, response, created)
+            )
+
+    def clear(self):
+        self.entries.clear()
+        if self.db:
+            self.db.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_secs": self.ttl_secs,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "disk_tier": bool(self.db)
+        }
+
+llm_cache = ResponseCache(LLM_CACHE_SIZE, LLM_CACHE_TTL_SECS, LLM_CACHE_PATH)
+
+async def create_chat_completion(messages: list) -> str:
+    """Run a chat completion without blocking the event loop"""
+    async with openai_limiter.slot():
+        with stage_timer("openai"):
+            response = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=200,
+                timeout=OPENAI_TIMEOUT_SECS
+            )
+    return response.choices[0].message.content
+
+async def stream_chat_completion(messages: list) -> AsyncIterator[str]:
+    """Yield completion text as OpenAI produces it"""
+    async with openai_limiter.slot():
+        with stage_timer("openai_stream"):
+            start = time.perf_counter()
+            stream = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=200,
+                timeout=OPENAI_TIMEOUT_SECS,
+                stream=True
+            )
+            first_token = True
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        observe_stage("openai_first_token", time.perf_counter() - start)
+                        first_token = False
+                    yield chunk.choices[0].delta.content
+
+def update_context(transfer_details: Dict[str, str], proof_type: str = None, session_id: str = DEFAULT_SESSION_ID):
+    """Update conversation context with latest transfer/proof details"""
+    fields = {}
+    if transfer_details:
+        fields["last_transfer"] = transfer_details
+    if proof_type:
+        fields["last_proof_type"] = proof_type
+    if fields:
+        conversation_store.update(session_id, **fields)
+
+# --- Circle Node Workers ---
+
+# Resolve node once at import instead of running `which node` per transfer
+NODE_PATH = shutil.which("node") or "node"
+AGENTKIT_DIR = os.path.expanduser(os.getenv("AGENTKIT_DIR", "~/agentkit"))
+CIRCLE_DIR = os.getenv("CIRCLE_DIR", os.path.join(AGENTKIT_DIR, "circle"))
+CIRCLE_WORKER_POOL_SIZE = int(os.getenv("CIRCLE_WORKER_POOL_SIZE", "4"))
+CIRCLE_TIMEOUT_SECS = float(os.getenv("CIRCLE_TIMEOUT_SECS", "120"))
+# A worker that keeps dying is restarted after 0.5s, 1s, 2s, ... up to the max
+CIRCLE_WORKER_RESTART_BACKOFF_SECS = float(os.getenv("CIRCLE_WORKER_RESTART_BACKOFF_SECS", "0.5"))
+CIRCLE_WORKER_MAX_BACKOFF_SECS = float(os.getenv("CIRCLE_WORKER_MAX_BACKOFF_SECS", "30"))
+
+class CircleResult(NamedTuple):
+    """Outcome of a Circle script run, from a pooled worker or a one-off process"""
+    returncode: int
+    data: Optional[dict]
+    stdout: str
+    stderr: str
+
+class CircleProcessError(Exception):
+    pass
+
+class CircleWorkersBusy(CircleProcessError):
+    """No pooled worker became free in time"""
+
+class CircleWorker:
+    """A long-lived `node circle/circleWorker.js` process speaking JSON lines"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.reader_task: Optional[asyncio.Task] = None
+        self.failures = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            NODE_PATH, os.path.join(CIRCLE_DIR, "circleWorker.js"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=AGENTKIT_DIR,
+            env=os.environ.copy(),
+            limit=1024 * 1024
+        )
+        self.reader_task = asyncio.create_task(self._read_responses())
+        print(f"Started Circle worker {self.index} (pid {self.process.pid})")
+
+    async def stop(self):
+        if self.alive:
+            self.process.kill()
+            await self.process.wait()
+        if self.reader_task:
+            await asyncio.gather(self.reader_task, return_exceptions=True)
+
+    async def restart(self):
+        await self.stop()
+        # Back off exponentially while the worker keeps failing, so a broken
+        # Node install or Circle outage doesn't turn into a spawn loop
+        delay = min(CIRCLE_WORKER_RESTART_BACKOFF_SECS * 2 ** self.failures, CIRCLE_WORKER_MAX_BACKOFF_SECS)
+        self.failures += 1
+        print(f"Restarting Circle worker {self.index} in {delay:g}s")
+        await asyncio.sleep(delay)
+        await self.start()
+
+    async def _read_responses(self):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            start = time.perf_counter()
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Circle worker {self.index} sent invalid JSON: {line!r}")
+                continue
+            future = self.pending.pop(message.get("id"), None)
+            if future and not future.done():
+                # The requester records the parse time under its own labels
+                future.set_result((message, time.perf_counter() - start))
+
+        # Worker exited, fail anything still waiting on it
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(CircleProcessError(f"Circle worker {self.index} exited"))
+        self.pending.clear()
+
+    async def request(self, payload: dict, timeout: float) -> dict:
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            self.process.stdin.write((json.dumps({"id": request_id, **payload}) + "\n").encode())
+            await self.process.stdin.drain()
+            message, parse_secs = await asyncio.wait_for(future, timeout)
+            observe_stage("circle_parse", parse_secs)
+            self.failures = 0
+            return message
+        finally:
+            self.pending.pop(request_id, None)
+
+class CircleWorkerPool:
+    """Fixed-size pool of Circle workers; crashed or hung workers are restarted"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.workers = []
+        self.idle: Optional[asyncio.Queue] = None
+
+    async def start(self):
+        self.idle = asyncio.Queue()
+        for index in range(self.size):
+            worker = CircleWorker(index)
+            await worker.start()
+            self.workers.append(worker)
+            self.idle.put_nowait(worker)
+
+    async def stop(self):
+        for worker in self.workers:
+            # A worker whose start failed has no process to close
+            if worker.process is not None:
+                worker.process.stdin.close()
+            await worker.stop()
+
+    async def request(self, payload: dict, timeout: float = CIRCLE_TIMEOUT_SECS) -> dict:
+        try:
+            worker = await asyncio.wait_for(self.idle.get(), timeout)
+        except asyncio.TimeoutError:
+            raise CircleWorkersBusy(f"No Circle worker free after {timeout:g}s")
+        try:
+            if not worker.alive:
+                await worker.restart()
+            return await worker.request(payload, timeout)
+        except asyncio.TimeoutError:
+            # A hung worker may never answer; replace it
+            await worker.restart()
+            raise CircleProcessError(f"Circle worker timed out after {timeout:g}s")
+        except (CircleProcessError, ConnectionError):
+            await worker.restart()
+            raise
+        finally:
+            self.idle.put_nowait(worker)
+
+circle_pool: Optional[CircleWorkerPool] = None
+
+def build_transfer_args(amount: str, recipient: str, blockchain: str) -> list:
+    """Arguments for executeTransfer.js, e.g. send 0.1 USDC to alice on solana"""
+    args = ["send", amount, "USDC", "to", recipient]
+    if blockchain == "SOL":
+        args += ["on", "solana"]
+    return args
+
+async def run_circle_script(script: str, args: list, timeout: float = CIRCLE_TIMEOUT_SECS) -> CircleResult:
+    """Run a Circle script in a fresh Node process (used when the pool is disabled)"""
+    argv = [NODE_PATH, os.path.join(CIRCLE_DIR, script)] + args
+    print(f"Executing Circle command: {' '.join(argv)}")
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=AGENTKIT_DIR,
+        env=os.environ.copy()
+    )
+    
+    stdout_lines = []
+    data = None
+    
+    async def read_stdout():
+        # Scripts mix log lines with their JSON result; keep the last JSON
+        # object line as it arrives instead of rescanning the whole output
+        nonlocal data
+        async for raw_line in process.stdout:
+            line = raw_line.decode(errors="replace")
+            stdout_lines.append(line)
+            line = line.strip()
+            if line.startswith('{') and line.endswith('}'):
+                try:
+                    with stage_timer("circle_parse"):
+                        data = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"JSON decode error, attempted to parse: {line}")
+    
+    try:
+        _, stderr = await asyncio.wait_for(
+            asyncio.gather(read_stdout(), process.stderr.read()),
+            timeout
+        )
+        await process.wait()
+    except asyncio.TimeoutError:
+        raise CircleProcessError(f"{script} timed out after {timeout:g}s")
+    finally:
+        # Timed out or cancelled: kill the child and reap it so it doesn't
+        # linger as a zombie with its pipes still open
+        if process.returncode is None:
+            process.kill()
+            await asyncio.shield(process.wait())
+    
+    return CircleResult(process.returncode, data, "".join(stdout_lines), stderr.decode(errors="replace"))
+
+async def call_circle_worker(payload: dict) -> CircleResult:
+    message = await circle_pool.request(payload)
+    output = message.get("output") or {}
+    stderr = output.get("error", "") if message.get("exitCode") else ""
+    return CircleResult(message.get("exitCode", 1), output, json.dumps(output), stderr)
+
+# --- Circle Rate Limiting ---
+
+CIRCLE_RATE_LIMIT_PER_SEC = float(os.getenv("CIRCLE_RATE_LIMIT_PER_SEC", "5"))
+CIRCLE_RATE_LIMIT_BURST = int(os.getenv("CIRCLE_RATE_LIMIT_BURST", "10"))
+CIRCLE_MAX_BACKOFF_SECS = float(os.getenv("CIRCLE_MAX_BACKOFF_SECS", "60"))
+
+class TokenBucket:
+    """Async token bucket that backs off when the upstream answers 429.
+
+    A 429 halves the refill rate and pauses all callers for an exponentially
+    growing delay; every successful call then restores a tenth of the
+    configured rate (AIMD), so we settle just under the real limit.
+    """
+
+    def __init__(self, rate: float, burst: int, max_backoff_secs: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_backoff_secs = max_backoff_secs
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff_secs = 1.0
+        self.rate_limited = 0
+        self.lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_rate_limited(self):
+        self.rate_limited += 1
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        self.tokens = 0.0
+        self.blocked_until = time.monotonic() + self.backoff_secs
+        self.backoff_secs = min(self.backoff_secs * 2, self.max_backoff_secs)
+
+    def on_success(self):
+        self.backoff_secs = 1.0
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate_per_sec": round(self.rate, 3),
+            "max_rate_per_sec": self.max_rate,
+            "burst": self.burst,
+            "rate_limited": self.rate_limited,
+            "paused_for_secs": round(max(0.0, self.blocked_until - time.monotonic()), 3)
+        }
+
+circle_rate_limiter = TokenBucket(CIRCLE_RATE_LIMIT_PER_SEC, CIRCLE_RATE_LIMIT_BURST, CIRCLE_MAX_BACKOFF_SECS)
+
+# Only the error the script reported: amounts, ids and hashes elsewhere in its output can contain "429"
+RATE_LIMITED_ERROR_PATTERN = re.compile(r"\b429\b|rate limit", re.IGNORECASE)
+
+def is_rate_limited(result: CircleResult) -> bool:
+    data = result.data or {}
+    if result.returncode == 0 and data.get("success") is not False:
+        return False
+    return data.get("status") == "rate_limited" or bool(RATE_LIMITED_ERROR_PATTERN.search(str(data.get("error", ""))))
+
+CIRCLE_MAX_CONCURRENCY = int(os.getenv("CIRCLE_MAX_CONCURRENCY", "8"))
+CIRCLE_MAX_QUEUE = int(os.getenv("CIRCLE_MAX_QUEUE", "64"))
+CIRCLE_QUEUE_TIMEOUT_SECS = float(os.getenv("CIRCLE_QUEUE_TIMEOUT_SECS", "15"))
+
+# Separate lanes, so a backlog of transfers doesn't hold up status checks
+circle_limiters = {
+    op: DependencyLimiter(f"circle_{op}", CIRCLE_MAX_CONCURRENCY, CIRCLE_MAX_QUEUE, CIRCLE_QUEUE_TIMEOUT_SECS)
+    for op in ("transfer", "status")
+}
+
+def circle_error_status(result: CircleResult) -> Optional[str]:
+    """"422" for Circle validation errors, "error" for other failures, None on success"""
+    data = result.data or {}
+    if result.returncode == 0 and data.get("success") is not False:
+        return None
+    error_msg = " ".join([result.stderr, result.stdout, str(data.get("error", ""))])
+    return "422" if "422" in error_msg else "error"
+
+async def call_circle(op: str, script: str, args: list, payload: dict) -> CircleResult:
+    """Run a Circle operation within its admission limit and the rate limit, and feed 429s back into it"""
+    async with circle_limiters[op].slot():
+        with stage_timer("circle_rate_limit"):
+            await circle_rate_limiter.acquire()
+        if circle_pool:
+            try:
+                with stage_timer("node_worker"):
+                    result = await call_circle_worker({"op": op, **payload})
+            except CircleWorkersBusy:
+                # Every worker is wedged or restarting; run this one on its own
+                with stage_timer("node_spawn"):
+                    result = await run_circle_script(script, args)
+        else:
+            with stage_timer("node_spawn"):
+                result = await run_circle_script(script, args)
+    
+    if is_rate_limited(result):
+        circle_rate_limiter.on_rate_limited()
+        circle_error = "429"
+    else:
+        circle_rate_limiter.on_success()
+        circle_error = circle_error_status(result)
+    if circle_error:
+        metrics.inc("agentkit_circle_errors_total", status=circle_error, op=op, blockchain=metrics_blockchain.get())
+    return result
+
+async def run_circle_transfer(amount: str, recipient: str, blockchain: str,
+                              idempotency_key: Optional[str] = None) -> CircleResult:
+    """Send a transfer; Circle dedupes retries that reuse `idempotency_key` (a UUID)"""
+    # Unvalidated input must not mint new label values
+    label = str(blockchain).upper()
+    metrics_blockchain.set(label if label in CHAIN_NAMES else "other")
+    args = build_transfer_args(amount, recipient, blockchain)
+    payload = {"args": args}
+    script_args = args
+    if idempotency_key:
+        payload["idempotencyKey"] = idempotency_key
+        script_args = args + ["--idempotency-key", idempotency_key]
+    return await call_circle("transfer", "executeTransfer.js", script_args, payload)
+
+async def run_circle_status(transfer_id: str) -> CircleResult:
+    return await call_circle("status", "circleHandler.js", [transfer_id], {"transferId": transfer_id})
+
+# --- Transfer Status Service ---
+
+STATUS_PENDING_TTL_SECS = float(os.getenv("STATUS_PENDING_TTL_SECS", "3"))
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", "10000"))
+
+def is_terminal_status(status_data: Dict[str, Any]) -> bool:
+    """Failed transfers, and complete ones with an on-chain hash, never change"""
+    status = status_data.get("status")
+    if status == "failed":
+        return True
+    return status == "complete" and status_data.get("transactionHash") not in (None, "", "pending")
+
+class TransferStatusService:
+    """Coalesced, cached Circle status lookups.
+
+    Concurrent lookups of the same transfer share one upstream call. Terminal
+    states are kept until LRU eviction; pending states are reused for
+    STATUS_PENDING_TTL_SECS so a UI polling every second doesn't become one
+    Circle call per poll.
+    """
+
+    def __init__(self, pending_ttl_secs: float, max_entries: int):
+        self.pending_ttl_secs = pending_ttl_secs
+        self.max_entries = max_entries
+        self.cache: "OrderedDict[str, Tuple[Dict[str, Any], float, bool]]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.upstream_calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+
+    async def get_status(self, transfer_id: str) -> Dict[str, Any]:
+        cached = self.cache.get(transfer_id)
+        if cached:
+            status_data, fetched_at, terminal = cached
+            if terminal or time.monotonic() - fetched_at < self.pending_ttl_secs:
+                self.cache.move_to_end(transfer_id)
+                self.cache_hits += 1
+                return status_data
+        
+        task = self.in_flight.get(transfer_id)
+        if task:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._fetch(transfer_id))
+            self.in_flight[transfer_id] = task
+            task.add_done_callback(lambda done: self._finish(transfer_id, done))
+        # Shield so one caller going away doesn't cancel the shared lookup
+        return await asyncio.shield(task)
+
+    def _finish(self, transfer_id: str, task: asyncio.Task):
+        self.in_flight.pop(transfer_id, None)
+        # If every caller was cancelled nobody awaits the error; retrieve it so
+        # asyncio doesn't log "Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, transfer_id: str) -> Dict[str, Any]:
+        self.upstream_calls += 1
+        result = await run_circle_status(transfer_id)
+        
+        if is_rate_limited(result):
+            return {
+                "status": "rate_limit",
+                "message": "Rate limit reached while checking status. Please try again in a moment."
+            }
+        if result.returncode != 0:
+            return {"error": result.stderr or result.stdout}
+        if result.data is None:
+            return {"error": "Failed to parse status result", "raw_output": result.stdout}
+        
+        if result.data.get("success") is not False:
+            self.cache[transfer_id] = (result.data, time.monotonic(), is_terminal_status(result.data))
+            self.cache.move_to_end(transfer_id)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return result.data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached": len(self.cache),
+            "in_flight": len(self.in_flight),
+            "upstream_calls": self.upstream_calls,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "rate_limiter": circle_rate_limiter.stats()
+        }
+
+transfer_status_service = TransferStatusService(STATUS_PENDING_TTL_SECS, STATUS_CACHE_SIZE)
+
+# --- Transfer Status Subscriptions ---
+
+STATUS_WATCH_INTERVAL_SECS = float(os.getenv("STATUS_WATCH_INTERVAL_SECS", "3"))
+STATUS_WATCH_TIMEOUT_SECS = float(os.getenv("STATUS_WATCH_TIMEOUT_SECS", "600"))
+STATUS_WATCH_MAX_ERRORS = int(os.getenv("STATUS_WATCH_MAX_ERRORS", "5"))
+
+class TransferWatcher:
+    """One server-side poll loop per watched transfer, fanned out to every subscriber.
+
+    The loop starts with the first subscriber and is cancelled when the last one
+    leaves, so transfers nobody is streaming don't spend the status rate limit
+    that user-facing requests need. Subscribers receive each distinct status (pending, then complete with the
+    transaction hash) as it is observed, followed by None once the transfer
+    reaches a terminal state or the watch gives up.
+    """
+
+    def __init__(self, interval_secs: float, timeout_secs: float, max_errors: int):
+        self.interval_secs = interval_secs
+        self.timeout_secs = timeout_secs
+        self.max_errors = max_errors
+        self.subscribers: Dict[str, set] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.latest: Dict[str, Dict[str, Any]] = {}
+
+    def watch(self, transfer_id: str):
+        if transfer_id not in self.tasks:
+            self.tasks[transfer_id] = asyncio.create_task(self._poll(transfer_id))
+
+    def subscribe(self, transfer_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(transfer_id, set()).add(queue)
+        if transfer_id in self.latest:
+            queue.put_nowait(self.latest[transfer_id])
+        self.watch(transfer_id)
+        return queue
+
+    def unsubscribe(self, transfer_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(transfer_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[transfer_id]
+                # Forget the loop now: a subscriber arriving before it unwinds starts a new one
+                task = self.tasks.pop(transfer_id, None)
+                self.latest.pop(transfer_id, None)
+                if task is not None:
+                    task.cancel()
+
+    def _publish(self, transfer_id: str, update: Optional[Dict[str, Any]]):
+        for queue in self.subscribers.get(transfer_id, ()):
+            queue.put_nowait(update)
+
+    async def _poll(self, transfer_id: str):
+        deadline = time.monotonic() + self.timeout_secs
+        last_seen = None
+        errors = 0
+        reason = "timeout"
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    status_data = await transfer_status_service.get_status(transfer_id)
+                except DependencyOverloaded:
+                    # Shed under load like any other caller; try again next interval
+                    await asyncio.sleep(self.interval_secs)
+                    continue
+                errors = errors + 1 if "error" in status_data else 0
+                
+                seen = (status_data.get("status"), status_data.get("transactionHash"), status_data.get("error"))
+                if seen != last_seen:
+                    last_seen = seen
+                    update = {"transferId": transfer_id, **status_data}
+                    self.latest[transfer_id] = update
+                    self._publish(transfer_id, update)
+                
+                if is_terminal_status(status_data):
+                    reason = "terminal"
+                    break
+                if errors >= self.max_errors:
+                    reason = "errors"
+                    break
+                await asyncio.sleep(self.interval_secs)
+        except asyncio.CancelledError:
+            reason = "shutdown" if self.tasks.get(transfer_id) is asyncio.current_task() else "unsubscribed"
+            raise
+        finally:
+            if reason != "terminal":
+                print(f"Stopped watching transfer {transfer_id}: {reason}")
+            # After an unsubscribe, the id's subscribers and state may belong to a newer loop
+            if self.tasks.get(transfer_id) is asyncio.current_task():
+                self._publish(transfer_id, None)
+                del self.tasks[transfer_id]
+                self.latest.pop(transfer_id, None)
+
+    async def stop(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+transfer_watcher = TransferWatcher(STATUS_WATCH_INTERVAL_SECS, STATUS_WATCH_TIMEOUT_SECS, STATUS_WATCH_MAX_ERRORS)
+
+def add_status_stream(transfer_data: Dict[str, Any]):
+    """Point a freshly created transfer at its status stream; polling starts once a client subscribes"""
+    transfer_id = transfer_data.get("transferId") or transfer_data.get("circleTransferId")
+    if transfer_id:
+        transfer_data["statusStream"] = f"/transfer_status_stream/{transfer_id}"
+
+# --- Transfer Idempotency ---
+
+TRANSFER_IDEMPOTENCY_TTL_SECS = float(os.getenv("TRANSFER_IDEMPOTENCY_TTL_SECS", "86400"))
+TRANSFER_IDEMPOTENCY_SIZE = int(os.getenv("TRANSFER_IDEMPOTENCY_SIZE", "10000"))
+TRANSFER_IDEMPOTENCY_PATH = os.getenv("TRANSFER_IDEMPOTENCY_PATH", "transfer_idempotency.db")
+IDEMPOTENCY_POLL_SECS = 0.25
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request"""
+
+class IdempotencyStore:
+    """Results of side-effecting requests, by idempotency key.
+
+    A duplicate of an in-flight request waits for the original instead of
+    starting another one; a duplicate of a completed request gets the stored
+    result back until TTL. Only results accepted by `is_final` are stored, so
+    failures (429s, timeouts) can be retried under the same key.
+
+    With a SQLite path, in-flight claims and results survive restarts and are
+    shared by uvicorn workers. A claim left behind by a crashed process is
+    taken over after `in_flight_timeout_secs`; Circle idempotency keys make
+    that re-run safe.
+    """
+
+    def __init__(self, ttl_secs: float, max_entries: int, path: str = "",
+                 in_flight_timeout_secs: float = CIRCLE_TIMEOUT_SECS * 2):
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries
+        self.in_flight_timeout_secs = in_flight_timeout_secs
+        self.results: "OrderedDict[str, Tuple[str, Dict[str, Any], float]]" = OrderedDict()
+        self.in_flight: Dict[str, Tuple[str, asyncio.Task]] = {}
+        self.executed = 0
+        self.replayed = 0
+        self.path = path
+        self.db = None
+
+    def open(self):
+        """Open the SQLite table; called from startup so importing the module creates no files"""
+        if not self.path or self.db:
+            return
+        self.db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency (key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+            "state TEXT NOT NULL, result TEXT, updated REAL NOT NULL)"
+        )
+        self.db.execute(
+            "DELETE FROM idempotency WHERE state = 'done' AND updated < ?",
+            (time.time() - self.ttl_secs,)
+        )
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    @staticmethod
+    def fingerprint(details: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(details, sort_keys=True).encode()).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        entry = self.results.get(key)
+        if entry is None:
+            return None
+        fingerprint, result, stored_at = entry
+        if time.time() - stored_at > self.ttl_secs:
+            del self.results[key]
+            return None
+        self.results.move_to_end(key)
+        return fingerprint, result
+
+    def _remember(self, key: str, fingerprint: str, result: Dict[str, Any], stored_at: float):
+        self.results[key] = (fingerprint, result, stored_at)
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def _claim(self, key: str, fingerprint: str) -> Tuple[bool, Optional[Tuple[str, Dict[str, Any]]]]:
+        """Try to claim `key` in the database.
+
+        Returns (True, None) once the claim is ours, (False, (fingerprint, result))
+        if the key is already done or used differently, and (False, None) while
+        another process is running it.
+        """
+        now = time.time()
+        claimed = self.db.execute(
+            "INSERT INTO idempotency (key, fingerprint, state, result, updated) "
+            "VALUES (?, ?, 'in_flight', NULL, ?) "
+            "ON CONFLICT(key) DO UPDATE SET fingerprint = excluded.fingerprint, state = 'in_flight', "
+            "result = NULL, updated = excluded.updated "
+            "WHERE (state = 'done' AND updated < ?) OR (state = 'in_flight' AND updated < ?)",
+            (key, fingerprint, now, now - self.ttl_secs, now - self.in_flight_timeout_secs)
+        ).rowcount
+        if claimed:
+            return True, None
+        
+        row = self.db.execute(
+            "SELECT fingerprint, state, result, updated FROM idempotency WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return False, None
+        if row[0] != fingerprint:
+            return False, (row[0], {})
+        if row[1] == "done":
+            result = json.loads(row[2])
+            self._remember(key, row[0], result, row[3])
+            return False, (row[0], result)
+        return False, None
+
+    async def _claim_or_wait(self, key: str, fingerprint: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        while True:
+            claimed, stored = self._claim(key, fingerprint)
+            if claimed or stored:
+                return stored
+            # Another worker is running this request; wait for its result
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECS)
+
+    def _finish(self, key: str, fingerprint: str, result: Dict[str, Any], final: bool):
+        if final:
+            stored_at = time.time()
+            self._remember(key, fingerprint, result, stored_at)
+            if self.db:
+                self.db.execute(
+                    "UPDATE idempotency SET state = 'done', result = ?, updated = ? WHERE key = ?",
+                    (json.dumps(result), stored_at, key)
+                )
+        elif self.db:
+            # Not stored: release the claim so the request can be retried
+            self.db.execute("DELETE FROM idempotency WHERE key = ? AND state = 'in_flight'", (key,))
+
+    async def run(self, key: str, details: Dict[str, Any], operation: Callable[[], Awaitable[Dict[str, Any]]],
+                  is_final: Callable[[Dict[str, Any]], bool]) -> Tuple[Dict[str, Any], bool]:
+        """Run `operation` once per key; returns (result, whether it was a duplicate)"""
+        fingerprint = self.fingerprint(details)
+        
+        stored = self._lookup(key)
+        if stored is None:
+            running = self.in_flight.get(key)
+            if running:
+                if running[0] != fingerprint:
+                    raise IdempotencyConflict(f"Idempotency key {key} was used for a different request")
+                self.replayed += 1
+                return await asyncio.shield(running[1]), True
+            if self.db:
+                stored = await self._claim_or_wait(key, fingerprint)
+        if stored:
+            if stored[0] != fingerprint:
+                raise IdempotencyConflict(f"Idempotency key {key} was used for a different request")
+            self.replayed += 1
+            return stored[1], True
+        
+        async def execute() -> Dict[str, Any]:
+            self.executed += 1
+            result = None
+            try:
+                result = await operation()
+                return result
+            finally:
+                self._finish(key, fingerprint, result, result is not None and is_final(result))
+        
+        task = asyncio.ensure_future(execute())
+        self.in_flight[key] = (fingerprint, task)
+        task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shield so a disconnecting caller doesn't abort a transfer mid-flight
+        return await asyncio.shield(task), False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stored": len(self.results),
+            "in_flight": len(self.in_flight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "persistent": bool(self.db)
+        }
+
+transfer_idempotency = IdempotencyStore(TRANSFER_IDEMPOTENCY_TTL_SECS, TRANSFER_IDEMPOTENCY_SIZE, TRANSFER_IDEMPOTENCY_PATH)
+
+def circle_idempotency_key(key: str) -> str:
+    """Circle wants a UUID; derive a stable one so retries reuse it"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"verifiable-agentkit/transfer/{key}"))
+
+def normalize_amount(amount: Any, default: Optional[str] = "0.1") -> Optional[str]:
+    """Round amount to 2 decimal places (Circle rejects more with a 422)"""
+    try:
+        return str(round(float(amount), 2))
+    except (TypeError, ValueError):
+        return default
+
+def transfer_succeeded(transfer_data: Dict[str, Any]) -> bool:
+    return "error" not in transfer_data and transfer_data.get("success") is not False
+
+async def run_direct_transfer(amount: str, recipient: str, blockchain: str,
+                              idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """Send a transfer and shape the result (or error) like /execute_direct_transfer"""
+    result = await run_circle_transfer(amount, recipient, blockchain, idempotency_key)
+    
+    if result.returncode != 0:
+        error_msg = result.stderr or result.stdout
+        
+        # Check for rate limit error
+        if "429" in error_msg or "rate limit" in error_msg.lower():
+            return {
+                "error": "rate_limit",
+                "message": "Circle API rate limit reached. The transfer is being processed but may take a moment.",
+                "details": error_msg
+            }
+        
+        # Check for validation errors (like decimal precision)
+        if "422" in error_msg:
+            return {
+                "error": "validation_error",
+                "message": f"Transfer validation failed. Please ensure the amount ({amount}) is valid with up to 2 decimal places.",
+                "details": error_msg
+            }
+        
+        print(f"Transfer command failed: {error_msg}")
+        return {"error": error_msg}
+    
+    if result.data is None:
+        print(f"Failed to parse transfer result: {result.stdout}")
+        return {"error": "Failed to parse transfer result", "raw_output": result.stdout}
+    
+    add_status_stream(result.data)
+    return result.data
+
+# --- Proof Reuse ---
+
+PROOFS_DIR = os.getenv("PROOFS_DIR", "./proofs")
+WASM_DIR = os.getenv("WASM_DIR", "./zkengine/example_wasms")
+PROOF_CACHE_SIZE = int(os.getenv("PROOF_CACHE_SIZE", "256"))
+PROOF_CACHE_TTL_SECS = float(os.getenv("PROOF_CACHE_TTL_SECS", "86400"))
+PROOF_SCAN_INTERVAL_SECS = float(os.getenv("PROOF_SCAN_INTERVAL_SECS", "10"))
+
+# Must match the function -> WASM mapping in src/main.rs
+PROOF_WASM_FILES = {
+    "prove_kyc": "prove_kyc.wasm",
+    "prove_ai_content": "prove_ai_content.wasm",
+    "prove_location": "prove_location.wasm"
+}
+
+PROOF_ARGUMENTS = {
+    "prove_kyc": ["1"],  # KYC always uses argument "1"
+    "prove_ai_content": ["content_hash", "openai"],  # Example arguments
+    "prove_location": ["12345"]  # Example packed coordinates
+}
+DEFAULT_STEP_SIZE = 50
+
+# --- Step Size Planning ---
+
+STEP_SIZE_BENCHMARKS_PATH = os.getenv("STEP_SIZE_BENCHMARKS_PATH", "benchmarks/results/step_size.json")
+STEP_SIZE_OBJECTIVE = os.getenv("STEP_SIZE_OBJECTIVE", "time")
+STEP_SIZE_MIN_SAMPLES = int(os.getenv("STEP_SIZE_MIN_SAMPLES", "2"))
+STEP_SIZE_OBJECTIVES = ("time", "size", "balanced")
+
+def argument_pattern(arguments: list) -> str:
+    """Shape of a proof's arguments, e.g. ["42", "openai"] -> "n,s" """
+    return ",".join("n" if re.fullmatch(r"-?\d+(?:\.\d+)?", str(arg)) else "s" for arg in arguments)
+
+def wasm_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
 
-class ChatResponse(BaseModel):
-    response: str
-    metadata: dict
+class StepSizePlanner:
+    """Picks step_size per WASM and argument pattern from recorded proof runs.
 
-def extract_transfer_details(message: str, context: Dict[str, Any]) -> Dict[str, str]:
-    """Extract transfer details from message with context awareness"""
-    
-    # Check for context-aware commands
-    context_patterns = [
-        r"do the same (?:but )?on (\w+)",
-        r"same (?:transfer|thing) (?:but )?on (\w+)",
-        r"now (?:do it )?on (\w+)",
-        r"repeat (?:that )?on (\w+)"
-    ]
-    
-    for pattern in context_patterns:
-        match = re.search(pattern, message.lower())
-        if match and context.get("last_transfer"):
-            blockchain = match.group(1).lower()
-            # Use previous transfer details but update blockchain
-            previous = context["last_transfer"]
-            return {
-                "amount": previous["amount"],
-                "recipient": previous["recipient"],
-                "blockchain": "SOL" if "sol" in blockchain else "ETH"
+    Samples come from benchmarks/step_size_sweep.py results, reloaded when the
+    file changes, and from every proof the Rust server finishes: it writes
+    the run's time and size to metrics.json next to the proof's metadata.json
+    in PROOFS_DIR, which is scanned for new proofs every
+    PROOF_SCAN_INTERVAL_SECS. A step size needs STEP_SIZE_MIN_SAMPLES
+    complete runs to be considered; the objective compares median generation
+    time, median proof size, or the sum of both relative to the best
+    observed value ("balanced").
+    """
+
+    def __init__(self, benchmarks_path: str, proofs_dir: str, objective: str, min_samples: int,
+                 default_step_size: int, scan_interval_secs: float):
+        if objective not in STEP_SIZE_OBJECTIVES:
+            raise ValueError(f"Unknown STEP_SIZE_OBJECTIVE: {objective}")
+        self.benchmarks_path = benchmarks_path
+        self.proofs_dir = proofs_dir
+        self.objective = objective
+        self.min_samples = min_samples
+        self.default_step_size = default_step_size
+        self.scan_interval_secs = scan_interval_secs
+        self.benchmarks_mtime: Optional[float] = None
+        self.benchmark_runs: list = []
+        # proof id -> run, or None for finished proofs that can't be planned
+        self.proof_runs: Dict[str, Optional[tuple]] = {}
+        self.last_scan = 0.0
+        # (wasm name, argument pattern) -> step size -> [(seconds, megabytes)]
+        self.samples: Dict[Tuple[str, str], Dict[int, list]] = {}
+
+    def _load_benchmarks(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.benchmarks_path)
+        except OSError:
+            mtime = None
+        if mtime == self.benchmarks_mtime:
+            return False
+        self.benchmarks_mtime = mtime
+        self.benchmark_runs = []
+        if mtime is None:
+            return True
+        try:
+            with open(self.benchmarks_path) as f:
+                records = json.load(f)
+            for record in records:
+                if record.get("status") != "complete" or record.get("generation_time_secs") is None:
+                    continue
+                self.benchmark_runs.append((
+                    wasm_name(record["wasm_path"]),
+                    argument_pattern(record.get("arguments", [])),
+                    int(record.get("step_size", self.default_step_size)),
+                    float(record["generation_time_secs"]),
+                    float(record.get("file_size_mb") or 0.0)
+                ))
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            print(f"Skipping proof metrics in {self.benchmarks_path}: {e}")
+        return True
+
+    def _scan_proofs(self) -> bool:
+        """Pick up proofs the Rust server finished since the last scan"""
+        self.last_scan = time.monotonic()
+        try:
+            proof_ids = os.listdir(self.proofs_dir)
+        except OSError:
+            return False
+        added = False
+        for proof_id in proof_ids:
+            if proof_id in self.proof_runs:
+                continue
+            proof_dir = os.path.join(self.proofs_dir, proof_id)
+            try:
+                with open(os.path.join(proof_dir, "metrics.json")) as f:
+                    metrics = json.load(f)
+                with open(os.path.join(proof_dir, "metadata.json")) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                # Still generating, or failed; failed proofs never get metrics
+                continue
+            wasm_file = PROOF_WASM_FILES.get(metadata.get("function"))
+            if not wasm_file or metrics.get("generation_time_secs") is None:
+                self.proof_runs[proof_id] = None
+                continue
+            self.proof_runs[proof_id] = (
+                wasm_name(wasm_file),
+                argument_pattern(metadata.get("arguments", [])),
+                int(metadata.get("step_size", self.default_step_size)),
+                float(metrics["generation_time_secs"]),
+                float(metrics.get("file_size_mb") or 0.0)
+            )
+            added = True
+        return added
+
+    def refresh(self):
+        changed = self._load_benchmarks()
+        if time.monotonic() - self.last_scan >= self.scan_interval_secs:
+            changed = self._scan_proofs() or changed
+        if not changed:
+            return
+        
+        samples: Dict[Tuple[str, str], Dict[int, list]] = {}
+        for run in self.benchmark_runs + [run for run in self.proof_runs.values() if run]:
+            name, pattern, step_size, seconds, megabytes = run
+            samples.setdefault((name, pattern), {}).setdefault(step_size, []).append((seconds, megabytes))
+        self.samples = samples
+
+    def curve(self, name: str, arguments: list) -> list:
+        """Median time and size per step size, smallest step first"""
+        self.refresh()
+        by_step = self.samples.get((name, argument_pattern(arguments)), {})
+        return [
+            {
+                "step_size": step_size,
+                "samples": len(runs),
+                "median_generation_time_secs": round(statistics.median(seconds for seconds, _ in runs), 3),
+                "median_file_size_mb": round(statistics.median(megabytes for _, megabytes in runs), 3)
             }
-    
-    # Standard extraction for new transfers
-    amount_match = re.search(r"(\d+(?:\.\d+)?)\s*(?:USDC|usdc)", message)
-    amount = amount_match.group(1) if amount_match else "0.1"
-    
-    # Round to 2 decimal places for USDC
-    try:
-        amount = str(round(float(amount), 2))
-    except:
-        amount = "0.1"
-    
-    # Extract recipient
-    recipient_patterns = [
-        r"to\s+(\w+)",
-        r"send\s+(?:\d+(?:\.\d+)?\s*USDC\s+)?to\s+(\w+)",
-        r"transfer\s+(?:\d+(?:\.\d+)?\s*USDC\s+)?to\s+(\w+)"
-    ]
-    
-    recipient = "alice"  # default
-    for pattern in recipient_patterns:
-        match = re.search(pattern, message, re.IGNORECASE)
-        if match:
-            recipient = match.group(1).lower()
-            break
-    
-    # Determine blockchain
-    blockchain = "SOL" if "solana" in message.lower() or "sol" in message.lower() else "ETH"
-    
-    return {
-        "amount": amount,
-        "recipient": recipient,
-        "blockchain": blockchain
-    }
+            for step_size, runs in sorted(by_step.items())
+        ]
 
-def update_context(transfer_details: Dict[str, str], proof_type: str = None):
-    """Update conversation context with latest transfer/proof details"""
-    if transfer_details:
-        conversation_context["last_transfer"] = transfer_details
-    if proof_type:
-        conversation_context["last_proof_type"] = proof_type
+    def plan(self, name: str, arguments: list) -> int:
+        candidates = [point for point in self.curve(name, arguments) if point["samples"] >= self.min_samples]
+        if not candidates:
+            return self.default_step_size
+        
+        best_time = min(point["median_generation_time_secs"] for point in candidates) or 1.0
+        best_size = min(point["median_file_size_mb"] for point in candidates) or 1.0
+        
+        def score(point):
+            if self.objective == "time":
+                return point["median_generation_time_secs"]
+            if self.objective == "size":
+                return point["median_file_size_mb"]
+            return point["median_generation_time_secs"] / best_time + point["median_file_size_mb"] / best_size
+        
+        return min(candidates, key=score)["step_size"]
 
-@app.post("/chat")
-async def chat(request: ChatRequest):
+step_size_planner = StepSizePlanner(
+    STEP_SIZE_BENCHMARKS_PATH,
+    PROOFS_DIR,
+    STEP_SIZE_OBJECTIVE,
+    STEP_SIZE_MIN_SAMPLES,
+    DEFAULT_STEP_SIZE,
+    PROOF_SCAN_INTERVAL_SECS
+)
+
+def plan_step_size(function: str) -> int:
+    return step_size_planner.plan(wasm_name(PROOF_WASM_FILES[function]), PROOF_ARGUMENTS[function])
+
+class ProofCache:
+    """Verified proofs in PROOFS_DIR indexed by what determines their content.
+
+    The key is (WASM content hash, function, arguments, step_size), so an
+    identical intent can reuse an existing proof instead of running zkEngine
+    again. Entries are invalidated when the proof files disappear, when the
+    WASM is modified after the proof was made, or after PROOF_CACHE_TTL_SECS;
+    the least recently used entries go beyond PROOF_CACHE_SIZE.
+    """
+
+    def __init__(self, proofs_dir: str, wasm_dir: str, max_entries: int, ttl_secs: float, scan_interval_secs: float):
+        self.proofs_dir = proofs_dir
+        self.wasm_dir = wasm_dir
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self.scan_interval_secs = scan_interval_secs
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.wasm_hashes: Dict[str, Tuple[float, int, str]] = {}
+        self.indexed: set = set()
+        self.last_scan = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _wasm_path(self, function: str) -> Optional[str]:
+        wasm_file = PROOF_WASM_FILES.get(function)
+        return os.path.join(self.wasm_dir, wasm_file) if wasm_file else None
+
+    def wasm_hash(self, function: str) -> Optional[str]:
+        path = self._wasm_path(function)
+        if not path:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self.wasm_hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self.wasm_hashes[path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def key(self, function: str, arguments: list, step_size: int) -> Optional[str]:
+        wasm_hash = self.wasm_hash(function)
+        if wasm_hash is None:
+            return None
+        return json.dumps([wasm_hash, function, [str(arg) for arg in arguments], int(step_size)])
+
+    def _is_valid(self, proof_id: str, function: str, created: float) -> bool:
+        proof_dir = os.path.join(self.proofs_dir, proof_id)
+        if time.time() - created > self.ttl_secs:
+            return False
+        if not all(os.path.exists(os.path.join(proof_dir, name)) for name in ("proof.bin", "public.json", ".verified")):
+            return False
+        try:
+            return os.path.getmtime(self._wasm_path(function)) <= created
+        except OSError:
+            return False
+
+    def add(self, proof_id: str, function: str, arguments: list, step_size: int, created: float):
+        key = self.key(function, arguments, step_size)
+        if key is None or not self._is_valid(proof_id, function, created):
+            return
+        current = self.entries.get(key)
+        if current is None or current[1] < created:
+            self.entries[key] = (proof_id, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def scan(self):
+        """Index verified proofs the Rust server has written since the last scan"""
+        self.last_scan = time.monotonic()
+        try:
+            proof_ids = os.listdir(self.proofs_dir)
+        except OSError:
+            return
+        for proof_id in proof_ids:
+            if proof_id in self.indexed:
+                continue
+            proof_dir = os.path.join(self.proofs_dir, proof_id)
+            # Unverified proofs are picked up on a later scan once verified
+            if not os.path.exists(os.path.join(proof_dir, ".verified")):
+                continue
+            try:
+                with open(os.path.join(proof_dir, "metadata.json")) as f:
+                    metadata = json.load(f)
+                created = os.path.getmtime(os.path.join(proof_dir, "proof.bin"))
+            except (OSError, ValueError):
+                # Still being written; try again on the next scan
+                continue
+            self.indexed.add(proof_id)
+            self.add(
+                proof_id,
+                metadata.get("function"),
+                metadata.get("arguments", []),
+                metadata.get("step_size", DEFAULT_STEP_SIZE),
+                created
+            )
+
+    def lookup(self, function: str, arguments: list, step_size: int) -> Optional[str]:
+        """Return the id of a verified proof identical to the requested one"""
+        if time.monotonic() - self.last_scan >= self.scan_interval_secs:
+            self.scan()
+        key = self.key(function, arguments, step_size)
+        entry = self.entries.get(key) if key else None
+        if entry and not self._is_valid(entry[0], function, entry[1]):
+            del self.entries[key]
+            self.invalidations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_secs": self.ttl_secs,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations
+        }
+
+proof_cache = ProofCache(PROOFS_DIR, WASM_DIR, PROOF_CACHE_SIZE, PROOF_CACHE_TTL_SECS, PROOF_SCAN_INTERVAL_SECS)
+
+def find_reusable_proof(function: str) -> Optional[str]:
+    if not proof_cache.enabled:
+        return None
+    return proof_cache.lookup(function, PROOF_ARGUMENTS[function], plan_step_size(function))
+
+# --- Proof Registry ---
+
+PROOFS_DB_PATH = os.getenv("PROOFS_DB_PATH", "static/proofs_db.json")
+VERIFICATIONS_DB_PATH = os.getenv("VERIFICATIONS_DB_PATH", "static/verifications_db.json")
+PROOF_REGISTRY_PATH = os.getenv("PROOF_REGISTRY_PATH", "proof_registry.db")
+PROOF_REGISTRY_SYNC_SECS = float(os.getenv("PROOF_REGISTRY_SYNC_SECS", "5"))
+PROOF_REGISTRY_PAGE_LIMIT = 200
+
+def file_mtime(path: str) -> Optional[float]:
     try:
-        # Add to conversation history
-        conversation_context["conversation_history"].append({
-            "role": "user",
-            "content": request.message,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Build context for GPT
-        context_info = ""
-        if conversation_context["last_transfer"]:
-            last = conversation_context["last_transfer"]
-            context_info = f"\nPrevious transfer: {last['amount']} USDC to {last['recipient']} on {last['blockchain']}"
-        
-        # Enhanced prompt with context awareness
-        prompt = f"""You are a helpful assistant for a verifiable agent system that can generate zero-knowledge proofs and execute USDC transfers on Ethereum and Solana.
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def file_timestamp(mtime: float) -> str:
+    """A file's mtime in the UTC ISO format the Rust server uses for proof records"""
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+class ProofRegistry:
+    """SQLite index over the proofs the Rust server has produced.
+
+    Proofs come from the proof directories the Rust server writes into
+    PROOFS_DIR (metadata.json, proof.bin, metrics.json with the generation
+    time, and .verified once zkEngine verified them), plus the proofs_db.json
+    and verifications_db.json history files, which stay the source of truth
+    for what they hold. Sources are re-imported only when they change, and
+    then only new or changed records are written: proofs by id and status,
+    verifications (an append-only list) from the last imported position,
+    proof directories by the mtimes of their files. Lookups by function,
+    status, timestamp and file hash go through indexes instead of a full
+    parse.
+    """
+
+    def __init__(self, path: str, proofs_path: str, verifications_path: str, proofs_dir: str,
+                 sync_interval_secs: float):
+        self.path = path
+        self.proofs_path = proofs_path
+        self.verifications_path = verifications_path
+        self.proofs_dir = proofs_dir
+        self.sync_interval_secs = sync_interval_secs
+        self.last_sync = 0.0
+        # proof id -> (proof.bin, .verified, metrics.json mtimes) as last imported
+        self.proof_dirs: Dict[str, Tuple[float, Optional[float], Optional[float]]] = {}
+        self.conn = None
+
+    def open(self):
+        """Open the index; called from startup so importing the module creates no files"""
+        if self.conn:
+            return
+        self.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS proofs (
+                id TEXT PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                function TEXT NOT NULL,
+                entry_point TEXT,
+                wasm_path TEXT,
+                arguments TEXT NOT NULL,
+                step_size INTEGER,
+                generation_time_secs REAL,
+                file_size_mb REAL,
+                file_hash TEXT,
+                status TEXT,
+                file_path TEXT
+            );
+            CREATE INDEX IF NOT EXISTS proofs_function_timestamp ON proofs (function, timestamp);
+            CREATE INDEX IF NOT EXISTS proofs_function_status_timestamp ON proofs (function, status, timestamp);
+            CREATE INDEX IF NOT EXISTS proofs_status_timestamp ON proofs (status, timestamp);
+            CREATE INDEX IF NOT EXISTS proofs_timestamp ON proofs (timestamp);
+            CREATE INDEX IF NOT EXISTS proofs_file_hash ON proofs (file_hash);
+            CREATE TABLE IF NOT EXISTS verifications (
+                id TEXT PRIMARY KEY,
+                proof_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                is_valid INTEGER,
+                verification_time_secs REAL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS verifications_proof_timestamp ON verifications (proof_id, timestamp);
+            CREATE INDEX IF NOT EXISTS verifications_timestamp ON verifications (timestamp);
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                records INTEGER NOT NULL
+            );
+        """)
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _source_changed(self, path: str) -> Optional[Tuple[float, int, int]]:
+        """Return (mtime, size, records imported so far) if the file changed since the last import"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        row = self.conn.execute("SELECT mtime, size, records FROM sources WHERE path = ?", (path,)).fetchone()
+        if row and row["mtime"] == stat.st_mtime and row["size"] == stat.st_size:
+            return None
+        return stat.st_mtime, stat.st_size, row["records"] if row else 0
+
+    def _mark_source(self, path: str, mtime: float, size: int, records: int):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sources (path, mtime, size, records) VALUES (?, ?, ?, ?)",
+            (path, mtime, size, records)
+        )
+
+    def _sync_proofs(self):
+        changed = self._source_changed(self.proofs_path)
+        if changed is None:
+            return
+        mtime, size, _ = changed
+        with open(self.proofs_path) as f:
+            records = json.load(f)
+        
+        known = {row["id"]: row["status"] for row in self.conn.execute("SELECT id, status FROM proofs")}
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for proof_id, record in records.items():
+                status = record.get("status")
+                if known.get(proof_id, object()) == status:
+                    continue
+                metadata = record.get("metadata") or {}
+                metrics = record.get("metrics") or {}
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO proofs (id, timestamp, function, entry_point, wasm_path, arguments, "
+                    "step_size, generation_time_secs, file_size_mb, file_hash, status, file_path) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        proof_id,
+                        record.get("timestamp", ""),
+                        wasm_name(metadata.get("wasm_path", "")) or metadata.get("function", "unknown"),
+                        metadata.get("function"),
+                        metadata.get("wasm_path"),
+                        json.dumps(metadata.get("arguments", [])),
+                        metadata.get("step_size"),
+                        metrics.get("generation_time_secs"),
+                        metrics.get("file_size_mb"),
+                        metrics.get("file_hash"),
+                        status,
+                        record.get("file_path")
+                    )
+                )
+            self._mark_source(self.proofs_path, mtime, size, len(records))
+
+    def _sync_verifications(self):
+        changed = self._source_changed(self.verifications_path)
+        if changed is None:
+            return
+        mtime, size, imported = changed
+        with open(self.verifications_path) as f:
+            records = json.load(f)
+        
+        # The file only grows; if it shrank it was rewritten, so re-import it
+        start = imported if len(records) >= imported else 0
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO verifications (id, proof_id, timestamp, is_valid, verification_time_secs, error) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        record["id"],
+                        record.get("proof_id"),
+                        record.get("timestamp", ""),
+                        None if record.get("is_valid") is None else int(record["is_valid"]),
+                        record.get("verification_time_secs"),
+                        record.get("error")
+                    )
+                    for record in records[start:]
+                ]
+            )
+            self._mark_source(self.verifications_path, mtime, size, len(records))
+
+    def _sync_proof_dirs(self):
+        try:
+            proof_ids = os.listdir(self.proofs_dir)
+        except OSError:
+            return
+        changed = []
+        for proof_id in proof_ids:
+            proof_dir = os.path.join(self.proofs_dir, proof_id)
+            try:
+                created = os.path.getmtime(os.path.join(proof_dir, "proof.bin"))
+            except OSError:
+                # Still generating, or zkEngine failed
+                continue
+            state = (created,) + tuple(file_mtime(os.path.join(proof_dir, name)) for name in (".verified", "metrics.json"))
+            if self.proof_dirs.get(proof_id) == state:
+                continue
+            try:
+                with open(os.path.join(proof_dir, "metadata.json")) as f:
+                    metadata = json.load(f)
+                size = os.path.getsize(os.path.join(proof_dir, "proof.bin"))
+                metrics = {}
+                if state[2] is not None:
+                    with open(os.path.join(proof_dir, "metrics.json")) as f:
+                        metrics = json.load(f)
+            except (OSError, ValueError):
+                # Still being written; try again on the next sync
+                continue
+            changed.append((proof_id, state, metadata, metrics, size))
+        if not changed:
+            return
+        
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for proof_id, (created, verified, _), metadata, metrics, size in changed:
+                function = metadata.get("function") or "unknown"
+                wasm_file = PROOF_WASM_FILES.get(function) or (metadata.get("additional_context") or {}).get("wasm_file")
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO proofs (id, timestamp, function, entry_point, wasm_path, arguments, "
+                    "step_size, generation_time_secs, file_size_mb, file_hash, status, file_path) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        proof_id,
+                        file_timestamp(created),
+                        function,
+                        None,
+                        os.path.join(WASM_DIR, wasm_file) if wasm_file else None,
+                        json.dumps(metadata.get("arguments", [])),
+                        metadata.get("step_size"),
+                        metrics.get("generation_time_secs"),
+                        size / (1024 * 1024),
+                        None,
+                        "complete",
+                        os.path.join(self.proofs_dir, proof_id, "proof.bin")
+                    )
+                )
+                # The Rust server only marks successful verifications
+                if verified is not None:
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO verifications (id, proof_id, timestamp, is_valid, "
+                        "verification_time_secs, error) VALUES (?, ?, ?, 1, NULL, NULL)",
+                        (f"{proof_id}/.verified", proof_id, file_timestamp(verified))
+                    )
+        for proof_id, state, _, _, _ in changed:
+            self.proof_dirs[proof_id] = state
+
+    def sync(self, force: bool = False):
+        if not force and time.monotonic() - self.last_sync < self.sync_interval_secs:
+            return
+        self.last_sync = time.monotonic()
+        for sync_source in (self._sync_proof_dirs, self._sync_proofs, self._sync_verifications):
+            try:
+                sync_source()
+            except (OSError, ValueError, KeyError, AttributeError) as e:
+                print(f"Proof registry import failed: {e}")
+
+    @staticmethod
+    def _proof_row(row: sqlite3.Row) -> Dict[str, Any]:
+        proof = dict(row)
+        proof["arguments"] = json.loads(proof["arguments"])
+        return proof
+
+    @staticmethod
+    def _page(limit: int, offset: int) -> Tuple[int, int]:
+        return max(1, min(limit, PROOF_REGISTRY_PAGE_LIMIT)), max(0, offset)
+
+    def list_proofs(self, function: Optional[str] = None, status: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None,
+                    file_hash: Optional[str] = None, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        self.sync()
+        clauses, params = [], []
+        for column, value in (("function", function), ("status", status), ("file_hash", file_hash)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        limit, offset = self._page(limit, offset)
+        
+        total = self.conn.execute(f"SELECT COUNT(*) FROM proofs {where}", params).fetchone()[0]
+        rows = self.conn.execute(
+            f"SELECT * FROM proofs {where} ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return {
+            "proofs": [self._proof_row(row) for row in rows],
+            "total": total,
+            "limit": limit,
+            "offset": offset
+        }
+
+    def latest_proof(self, function: Optional[str] = None, verified: bool = False) -> Optional[Dict[str, Any]]:
+        self.sync()
+        clauses, params = ["status = 'complete'"], []
+        if function:
+            clauses.append("function = ?")
+            params.append(function)
+        if verified:
+            clauses.append("EXISTS (SELECT 1 FROM verifications v WHERE v.proof_id = proofs.id AND v.is_valid = 1)")
+        row = self.conn.execute(
+            f"SELECT * FROM proofs WHERE {' AND '.join(clauses)} ORDER BY timestamp DESC LIMIT 1",
+            params
+        ).fetchone()
+        return self._proof_row(row) if row else None
+
+    def get_proof(self, proof_id: str) -> Optional[Dict[str, Any]]:
+        self.sync()
+        row = self.conn.execute("SELECT * FROM proofs WHERE id = ?", (proof_id,)).fetchone()
+        if row is None:
+            return None
+        proof = self._proof_row(row)
+        proof["verifications"] = [
+            dict(verification) for verification in self.conn.execute(
+                "SELECT * FROM verifications WHERE proof_id = ? ORDER BY timestamp DESC",
+                (proof_id,)
+            )
+        ]
+        return proof
+
+    def list_verifications(self, proof_id: Optional[str] = None, is_valid: Optional[bool] = None,
+                           since: Optional[str] = None, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        self.sync()
+        clauses, params = [], []
+        if proof_id:
+            clauses.append("proof_id = ?")
+            params.append(proof_id)
+        if is_valid is not None:
+            clauses.append("is_valid = ?")
+            params.append(int(is_valid))
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        limit, offset = self._page(limit, offset)
+        
+        total = self.conn.execute(f"SELECT COUNT(*) FROM verifications {where}", params).fetchone()[0]
+        rows = self.conn.execute(
+            f"SELECT * FROM verifications {where} ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return {
+            "verifications": [dict(row) for row in rows],
+            "total": total,
+            "limit": limit,
+            "offset": offset
+        }
+
+proof_registry = ProofRegistry(
+    PROOF_REGISTRY_PATH,
+    PROOFS_DB_PATH,
+    VERIFICATIONS_DB_PATH,
+    PROOFS_DIR,
+    PROOF_REGISTRY_SYNC_SECS
+)
+
+def parse_since(since: Optional[str]) -> Optional[str]:
+    """Accept ISO timestamps/dates, or "today" for midnight UTC"""
+    if since == "today":
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return since
+
+@app.on_event("startup")
+async def startup():
+    global circle_pool
+    llm_cache.open()
+    transfer_idempotency.open()
+    proof_registry.open()
+    if CIRCLE_WORKER_POOL_SIZE > 0:
+        pool = CircleWorkerPool(CIRCLE_WORKER_POOL_SIZE)
+        try:
+            await pool.start()
+            circle_pool = pool
+        except OSError as e:
+            print(f"Could not start Circle workers, spawning per request instead: {e}")
+            await pool.stop()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await client.close()
+    await transfer_watcher.stop()
+    if circle_pool:
+        await circle_pool.stop()
+    llm_cache.close()
+    transfer_idempotency.close()
+    proof_registry.close()
+
+def build_context_info(context: Dict[str, Any]) -> str:
+    """Context lines for GPT; also part of the response cache key"""
+    if context["last_transfer"]:
+        last = context["last_transfer"]
+        return f"\nPrevious transfer: {last['amount']} USDC to {last['recipient']} on {last['blockchain']}"
+    return ""
+
+def build_prompt(message: str, context_info: str) -> str:
+    # Enhanced prompt with context awareness
+    return f"""You are a helpful assistant for a verifiable agent system that can generate zero-knowledge proofs and execute USDC transfers on Ethereum and Solana.
 
 Available actions:
 1. Generate KYC compliance proofs
@@ -135,252 +2803,379 @@ Context awareness:
 - Remember previous transfer amounts and recipients
 {context_info}
 
-User message: {request.message}
+User message: {message}
 
 Determine the user's intent and provide a helpful response. If they want to repeat a previous action with modifications, acknowledge this clearly."""
 
-        # Get response from OpenAI using new API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": request.message}
-            ],
-            temperature=0.7,
-            max_tokens=200
-        )
-        
-        ai_response = response.choices[0].message.content
-        
-        # Determine intent and metadata
-        message_lower = request.message.lower()
-        metadata = {"action": "none"}
-        
-        # Check for context-aware commands first
-        if any(phrase in message_lower for phrase in ["do the same", "same thing", "now on", "repeat"]):
-            if conversation_context["last_transfer"] and any(blockchain in message_lower for blockchain in ["solana", "sol", "ethereum", "eth"]):
-                if conversation_context["last_proof_type"] == "kyc_transfer":
-                    metadata = {
-                        "action": "kyc_transfer",
-                        "details": extract_transfer_details(request.message, conversation_context)
-                    }
-                    # Update context with new blockchain but same other details
-                    update_context(metadata["details"], "kyc_transfer")
-        
-        # Standard intent detection
-        elif "kyc" in message_lower and ("send" in message_lower or "transfer" in message_lower):
-            transfer_details = extract_transfer_details(request.message, conversation_context)
-            metadata = {
-                "action": "kyc_transfer",
-                "details": transfer_details
-            }
-            update_context(transfer_details, "kyc_transfer")
-            
-        elif "send" in message_lower or "transfer" in message_lower:
-            if "kyc" not in message_lower:
-                transfer_details = extract_transfer_details(request.message, conversation_context)
-                metadata = {
-                    "action": "direct_transfer", 
-                    "details": transfer_details
-                }
-                update_context(transfer_details, "direct_transfer")
-                
-        elif "prove" in message_lower:
-            if "ai" in message_lower or "content" in message_lower:
-                metadata = {"action": "prove_ai_content"}
-                update_context(None, "prove_ai_content")
-            elif "location" in message_lower:
-                metadata = {"action": "prove_location"}
-                update_context(None, "prove_location")
-            elif "kyc" in message_lower:
-                metadata = {"action": "prove_kyc"}
-                update_context(None, "prove_kyc")
-                
-        elif "verify" in message_lower and "proof" in message_lower:
-            metadata = {"action": "verify_proof"}
-        
-        # Add conversation to history
-        conversation_context["conversation_history"].append({
-            "role": "assistant",
-            "content": ai_response,
-            "metadata": metadata,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Format response based on action type
-        if metadata.get("action") == "kyc_transfer":
+PROOF_EXPLANATIONS = {
+    "prove_kyc": "Generating KYC compliance proof",
+    "prove_ai_content": "Generating AI content verification proof",
+    "prove_location": "Generating location verification proof"
+}
+
+def proof_intent(function: str, explanation: str, additional_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {
+        "function": function,
+        "arguments": PROOF_ARGUMENTS[function],
+        "step_size": plan_step_size(function),
+        "explanation": explanation,
+        "additional_context": additional_context
+    }
+
+def build_chat_response(ai_response: str, metadata: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+    """Format the /chat response for the Rust server based on action type"""
+    action = metadata.get("action")
+    if action == "multi_action":
+        # One entry per action for the Rust server to run concurrently; the
+        # top-level intent/metadata mirror the first for older clients
+        responses = [build_chat_response("", sub_metadata, session_id) for sub_metadata in metadata["actions"]]
+        intents = [
+            {"intent": response.get("intent"), "metadata": response.get("metadata")}
+            for response in responses
+        ]
+        first_intent = next((entry for entry in intents if entry["intent"]), intents[0])
+        return {
+            "response": ai_response,
+            "intent": first_intent["intent"],
+            "metadata": first_intent["metadata"],
+            "intents": intents,
+            "actions": metadata["actions"]
+        }
+    if action == "kyc_transfer":
+        additional_context = {
+            "is_automated_transfer": True,
+            "transfer_details": metadata["details"],
+            "session_id": session_id
+        }
+        reused_proof_id = find_reusable_proof("prove_kyc")
+        if reused_proof_id:
+            # Verifying an identical proof is much cheaper than regenerating
+            # it, and the Rust server runs the transfer once it verifies
+            proof_id = reused_proof_id
+            additional_context["is_verification"] = True
+            additional_context["reused_proof"] = True
+            explanation = f"Reusing verified KYC compliance proof {proof_id} for USDC transfer"
+        else:
             # For KYC transfers, create a proof metadata that triggers the KYC proof flow
-            proof_id = f"proof_kyc_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            return {
-                "response": ai_response,
-                "intent": {
-                    "function": "prove_kyc",
-                    "arguments": ["1"],  # KYC always uses argument "1"
-                    "step_size": 50,
-                    "explanation": "Generating KYC compliance proof for USDC transfer",
-                    "additional_context": {
-                        "is_automated_transfer": True,
-                        "transfer_details": metadata["details"]
-                    }
-                },
-                "metadata": {
-                    "proof_id": proof_id,
-                    "is_automated_transfer": True,
-                    "transfer_details": metadata["details"]
-                }
-            }
-        elif metadata.get("action") == "prove_kyc":
-            # Standalone KYC proof
-            return {
-                "response": ai_response,
-                "intent": {
-                    "function": "prove_kyc",
-                    "arguments": ["1"],
-                    "step_size": 50,
-                    "explanation": "Generating KYC compliance proof",
-                    "additional_context": None
-                }
-            }
-        elif metadata.get("action") == "prove_ai_content":
-            return {
-                "response": ai_response,
-                "intent": {
-                    "function": "prove_ai_content",
-                    "arguments": ["content_hash", "openai"],  # Example arguments
-                    "step_size": 50,
-                    "explanation": "Generating AI content verification proof",
-                    "additional_context": None
-                }
+            # Suffixed so several KYC transfers from one message get their own proof dirs
+            proof_id = f"proof_kyc_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+            explanation = "Generating KYC compliance proof for USDC transfer"
+        # Lets /execute_verified_transfer tell retries from new transfers
+        additional_context["proof_id"] = proof_id
+        additional_context["transfer_request_id"] = uuid.uuid4().hex
+        return {
+            "response": ai_response,
+            "intent": proof_intent("prove_kyc", explanation, additional_context),
+            "metadata": {
+                "proof_id": proof_id,
+                "is_automated_transfer": True,
+                "transfer_details": metadata["details"],
+                "reused_proof": bool(reused_proof_id)
             }
-        elif metadata.get("action") == "prove_location":
+        }
+    elif action in PROOF_EXPLANATIONS:
+        reused_proof_id = find_reusable_proof(action)
+        if reused_proof_id:
+            # No intent: the Rust server would otherwise run zkEngine again
             return {
-                "response": ai_response,
-                "intent": {
-                    "function": "prove_location",
-                    "arguments": ["12345"],  # Example packed coordinates
-                    "step_size": 50,
-                    "explanation": "Generating location verification proof",
-                    "additional_context": None
+                "response": f"{ai_response}\n\nAn identical verified proof already exists: {reused_proof_id}",
+                "metadata": {
+                    "action": action,
+                    "proof_id": reused_proof_id,
+                    "reused_proof": True
                 }
             }
-        elif metadata.get("action") == "direct_transfer":
-            # Direct transfer without KYC - this should be handled differently
-            # Return the transfer details in a format the frontend can use
-            return {
-                "response": ai_response,
-                "metadata": metadata,
-                "action": "direct_transfer"
-            }
+        return {
+            "response": ai_response,
+            "intent": proof_intent(action, PROOF_EXPLANATIONS[action])
+        }
+    elif action == "verify_proof":
+        # "Verify the last KYC proof": resolve the proof from the registry
+        if metadata.get("proof_id"):
+            proof = proof_registry.get_proof(metadata["proof_id"])
         else:
+            proof = proof_registry.latest_proof(metadata.get("proof_type"))
+        if proof is None:
             return {
-                "response": ai_response,
+                "response": f"{ai_response}\n\nNo matching proof was found to verify.",
                 "metadata": metadata
             }
+        return {
+            "response": ai_response,
+            "intent": {
+                "function": proof["function"],
+                "arguments": proof["arguments"],
+                "step_size": proof["step_size"] or DEFAULT_STEP_SIZE,
+                "explanation": f"Verifying proof {proof['id']}",
+                "additional_context": {"is_verification": True}
+            },
+            "metadata": {"proof_id": proof["id"]}
+        }
+    elif action == "direct_transfer":
+        # Direct transfer without KYC - this should be handled differently
+        # Return the transfer details in a format the frontend can use
+        return {
+            "response": ai_response,
+            "metadata": metadata,
+            "action": "direct_transfer"
+        }
+    else:
+        return {
+            "response": ai_response,
+            "metadata": metadata
+        }
+
+class ChatTurn(NamedTuple):
+    """State of one /chat or /chat_stream call once its intent is known"""
+    session_id: str
+    message: str
+    metadata: Dict[str, Any]
+    confidence: float
+    fast_path: bool
+    context_info: str
+
+    @property
+    def cache_key(self) -> str:
+        return llm_cache.key(self.message, self.context_info)
+
+    @property
+    def completion_messages(self) -> list:
+        return [
+            {"role": "system", "content": build_prompt(self.message, self.context_info)},
+            {"role": "user", "content": self.message}
+        ]
+
+def start_chat_turn(request: ChatRequest) -> ChatTurn:
+    session_id = request.session_id
+    conversation_context = conversation_store.get(session_id)
+    mode = request.mode or CHAT_MODE
+    if mode not in CHAT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown chat mode: {mode}")
+    
+    # Determine intent and metadata
+    with stage_timer("intent"):
+        metadata, confidence = detect_chat_intent(request.message, conversation_context)
+    
+    # Clear commands don't need the LLM to pick an action
+    fast_path = mode == "rules" or (mode == "fast" and confidence >= INTENT_CONFIDENCE_THRESHOLD)
+    
+    return ChatTurn(
+        session_id=session_id,
+        message=request.message,
+        metadata=metadata,
+        confidence=confidence,
+        fast_path=fast_path,
+        context_info=build_context_info(conversation_context)
+    )
+
+def record_user_message(turn: ChatTurn):
+    """Add the user's message to history once the turn has been admitted"""
+    conversation_store.add_message(turn.session_id, {
+        "role": "user",
+        "content": turn.message,
+        "timestamp": datetime.now().isoformat()
+    })
+
+def remember_intent(turn: ChatTurn):
+    """Remember transfer details and action for follow-ups"""
+    # Of several actions, the last one is what "do the same" refers to
+    for metadata in turn.metadata.get("actions", [turn.metadata]):
+        action = metadata["action"]
+        if action != "none" and action != "verify_proof":
+            update_context(metadata.get("details"), action, turn.session_id)
+
+def finish_chat_turn(turn: ChatTurn, ai_response: str):
+    # Add conversation to history
+    conversation_store.add_message(turn.session_id, {
+        "role": "assistant",
+        "content": ai_response,
+        "metadata": turn.metadata,
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    try:
+        turn = start_chat_turn(request)
+        record_user_message(turn)
+        
+        cached = False
+        if turn.fast_path:
+            ai_response = describe_intent(turn.metadata)
+        else:
+            ai_response = llm_cache.get(turn.cache_key) if llm_cache.enabled else None
+            cached = ai_response is not None
+            if not cached:
+                # Get response from OpenAI without blocking other requests
+                ai_response = await create_chat_completion(turn.completion_messages)
+                if llm_cache.enabled:
+                    llm_cache.put(turn.cache_key, ai_response)
+        
+        remember_intent(turn)
+        finish_chat_turn(turn, ai_response)
+        
+        response = build_chat_response(ai_response, turn.metadata, turn.session_id)
+        response["fast_path"] = turn.fast_path
+        response["cached"] = cached
+        response["intent_confidence"] = turn.confidence
+        return response
         
+    except HTTPException:
+        raise
+    except APITimeoutError:
+        raise HTTPException(status_code=504, detail="OpenAI request timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat_stream")
+async def chat_stream(request: ChatRequest):
+    """Streaming /chat: an `intent` event first, then `token` events, then `done`"""
+    turn = start_chat_turn(request)
+    if not turn.fast_path and openai_limiter.saturated:
+        # Reject before the 200 and the intent event go out
+        raise DependencyOverloaded("openai", "queue full", openai_limiter.retry_after())
+    record_user_message(turn)
+    
+    # The intent doesn't depend on the LLM text, so send it right away and
+    # record it before the prose arrives
+    intent_event = build_chat_response("", turn.metadata, turn.session_id)
+    intent_event.pop("response")
+    intent_event["fast_path"] = turn.fast_path
+    intent_event["intent_confidence"] = turn.confidence
+    remember_intent(turn)
+    
+    async def events():
+        yield sse_event("intent", intent_event)
+        
+        cached = False
+        try:
+            if turn.fast_path:
+                ai_response = describe_intent(turn.metadata)
+                yield sse_event("token", {"text": ai_response})
+            else:
+                ai_response = llm_cache.get(turn.cache_key) if llm_cache.enabled else None
+                cached = ai_response is not None
+                if cached:
+                    yield sse_event("token", {"text": ai_response})
+                else:
+                    parts = []
+                    async for text in stream_chat_completion(turn.completion_messages):
+                        parts.append(text)
+                        yield sse_event("token", {"text": text})
+                    ai_response = "".join(parts)
+                    if llm_cache.enabled:
+                        llm_cache.put(turn.cache_key, ai_response)
+        except APITimeoutError:
+            yield sse_event("error", {"detail": "OpenAI request timed out"})
+            return
+        except HTTPException as e:
+            yield sse_event("error", {"detail": e.detail, "status_code": e.status_code})
+            return
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+            return
+        
+        finish_chat_turn(turn, ai_response)
+        yield sse_event("done", {"response": ai_response, "cached": cached})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def run_verified_transfer(amount: str, recipient: str, blockchain: str,
+                                idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """Send a KYC-verified transfer and shape the result for the Rust server"""
+    result = await run_circle_transfer(amount, recipient, blockchain, idempotency_key)
+    
+    print(f"Transfer command exit code: {result.returncode}")
+    print(f"Transfer stdout: {result.stdout}")
+    print(f"Transfer stderr: {result.stderr}")
+    
+    if result.data:
+        transfer_data = result.data
+        print(f"Parsed transfer result: {json.dumps(transfer_data, indent=2)}")
+        
+        # If we got an error in the JSON
+        if transfer_data.get("success") == False:
+            return {"success": False, "error": transfer_data.get("error", "Transfer failed")}
+        
+        # Ensure we have a success field for the Rust server
+        transfer_data["success"] = True
+        
+        # Add transfer details to the response
+        transfer_data["amount"] = amount
+        transfer_data["recipient"] = transfer_data.get("recipient", recipient)
+        transfer_data["blockchain"] = blockchain
+        transfer_data["from"] = transfer_data.get("from", "0x82a26a6d847e7e0961ab432b9a5a209e0db41040" if blockchain == "ETH" else "HsZdbBxZVNzEn4qR9Ebx5XxDSZ136Mu14VlH1nbXGhfG")
+        
+        # Get the Circle transfer ID
+        if "transferId" in transfer_data:
+            transfer_data["circleTransferId"] = transfer_data["transferId"]
+        
+        add_status_stream(transfer_data)
+        return transfer_data
+    
+    # If we couldn't parse JSON, return error
+    error_msg = result.stderr or result.stdout or "Unknown error"
+    print(f"Transfer failed with output: {error_msg}")
+    return {"success": False, "error": "Failed to parse transfer response"}
+
+def verified_transfer_key(request: dict, details: Dict[str, str]) -> Optional[str]:
+    """Idempotency key for a verified transfer: proof_id, chat turn and transfer details.
+
+    Reused proofs (see ProofCache) share a proof_id across chat turns, so the
+    per-turn transfer_request_id keeps two real transfers apart while the Rust
+    server's retries of one transfer collapse into one.
+    """
+    proof_id = request.get("proof_id")
+    if not proof_id:
+        return None
+    raw = json.dumps({"proof_id": proof_id, "request": request.get("transfer_request_id"), **details}, sort_keys=True)
+    return f"verified:{hashlib.sha256(raw.encode()).hexdigest()}"
+
 @app.post("/execute_verified_transfer")
 async def execute_verified_transfer(request: dict):
     """Execute a transfer that requires KYC verification"""
     try:
         # Extract transfer details from the additional_context
         transfer_details = request.get("transfer_details", {})
-        amount = transfer_details.get("amount", "0.1")
+        amount = normalize_amount(transfer_details.get("amount", "0.1"))
         recipient = transfer_details.get("recipient", "alice")
         blockchain = transfer_details.get("blockchain", "ETH")
-        
-        # Round amount to 2 decimal places
-        try:
-            amount = str(round(float(amount), 2))
-        except:
-            amount = "0.1"
+        session_id = request.get("session_id", DEFAULT_SESSION_ID)
         
         # Update context
         update_context({
             "amount": amount,
             "recipient": recipient,
             "blockchain": blockchain
-        }, "kyc_transfer")
+        }, "kyc_transfer", session_id)
         
-        # Build the command for the Circle transfer
-        # Use absolute path to node and the script
-        node_path = subprocess.run("which node", shell=True, capture_output=True, text=True).stdout.strip()
-        script_path = os.path.expanduser("~/agentkit/circle/executeTransfer.js")
+        details = {"amount": amount, "recipient": recipient, "blockchain": blockchain}
+        key = verified_transfer_key(request, details)
+        if key is None:
+            # Older callers don't send proof_id; nothing to dedupe on
+            return await run_verified_transfer(amount, recipient, blockchain)
         
-        if blockchain == "SOL":
-            command = f"{node_path} {script_path} send {amount} USDC to {recipient} on solana"
-        else:
-            command = f"{node_path} {script_path} send {amount} USDC to {recipient}"
-        
-        print(f"Executing transfer command: {command}")
-        print(f"Working directory: {os.path.expanduser('~/agentkit')}")
-        
-        # Set up environment with Circle credentials
-        env = os.environ.copy()
-        
-        # Execute the transfer with environment variables
-        result = subprocess.run(
-            command, 
-            shell=True, 
-            capture_output=True, 
-            text=True, 
-            cwd=os.path.expanduser("~/agentkit"),
-            env=env
+        # Retries and reconnects for the same proof get the original result
+        transfer_data, duplicate = await transfer_idempotency.run(
+            key,
+            details,
+            lambda: run_verified_transfer(amount, recipient, blockchain, circle_idempotency_key(key)),
+            lambda transfer_data: transfer_data.get("success") is True
         )
-        
-        print(f"Transfer command exit code: {result.returncode}")
-        print(f"Transfer stdout: {result.stdout}")
-        print(f"Transfer stderr: {result.stderr}")
-        
-        # Extract JSON from stdout
-        output = result.stdout
-        
-        # Try to extract JSON from output even if mixed with other text
-        # Look for JSON at the end of the output
-        output = result.stdout
-        lines = output.strip().split('\n')
-        json_str = None
-        
-        # Try to find the JSON line (usually the last line that starts with {)
-        for line in reversed(lines):
-            line = line.strip()
-            if line.startswith('{') and line.endswith('}'):
-                json_str = line
-                break
-        
-        if json_str:
-            try:
-                transfer_data = json.loads(json_str)
-                print(f"Parsed transfer result: {json.dumps(transfer_data, indent=2)}")
-                
-                # If we got an error in the JSON
-                if transfer_data.get("success") == False:
-                    return {"success": False, "error": transfer_data.get("error", "Transfer failed")}
-                
-                # Ensure we have a success field for the Rust server
-                transfer_data["success"] = True
-                
-                # Add transfer details to the response
-                transfer_data["amount"] = amount
-                transfer_data["recipient"] = transfer_data.get("recipient", recipient)
-                transfer_data["blockchain"] = blockchain
-                transfer_data["from"] = transfer_data.get("from", "0x82a26a6d847e7e0961ab432b9a5a209e0db41040" if blockchain == "ETH" else "HsZdbBxZVNzEn4qR9Ebx5XxDSZ136Mu14VlH1nbXGhfG")
-                
-                # Get the Circle transfer ID
-                if "transferId" in transfer_data:
-                    transfer_data["circleTransferId"] = transfer_data["transferId"]
-                
-                return transfer_data
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error: {str(e)}")
-                print(f"Attempted to parse: {json_str}")
-        
-        # If we couldn't parse JSON, return error
-        error_msg = result.stderr or result.stdout or "Unknown error"
-        print(f"Transfer failed with output: {error_msg}")
-        return {"success": False, "error": "Failed to parse transfer response"}
+        if duplicate:
+            print(f"Duplicate transfer request for proof {request.get('proof_id')}, returning original result")
+            return {**transfer_data, "duplicate": True}
+        return transfer_data
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Transfer execution error: {str(e)}")
         import traceback
@@ -391,65 +3186,134 @@ async def execute_verified_transfer(request: dict):
 async def execute_direct_transfer(request: dict):
     """Execute a direct transfer without KYC verification"""
     try:
-        amount = request.get("amount", "0.1")
+        amount = normalize_amount(request.get("amount", "0.1"))
         recipient = request.get("recipient", "alice")
         blockchain = request.get("blockchain", "ETH")
-        
-        # Round amount to 2 decimal places
-        try:
-            amount = str(round(float(amount), 2))
-        except:
-            amount = "0.1"
+        session_id = request.get("session_id", DEFAULT_SESSION_ID)
         
         # Update context
         update_context({
             "amount": amount,
             "recipient": recipient,
             "blockchain": blockchain
-        }, "direct_transfer")
-        
-        # Build the command for the Circle transfer
-        if blockchain == "SOL":
-            command = f"node circle/executeTransfer.js send {amount} USDC to {recipient} on solana"
-        else:
-            command = f"node circle/executeTransfer.js send {amount} USDC to {recipient}"
+        }, "direct_transfer", session_id)
         
         # Execute the transfer
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, cwd=os.path.expanduser("~/agentkit"))
-        
-        if result.returncode != 0:
-            error_msg = result.stderr or result.stdout
-            
-            # Check for rate limit error
-            if "429" in error_msg or "rate limit" in error_msg.lower():
-                return {
-                    "error": "rate_limit",
-                    "message": "Circle API rate limit reached. The transfer is being processed but may take a moment.",
-                    "details": error_msg
-                }
-            
-            # Check for validation errors (like decimal precision)
-            if "422" in error_msg:
-                return {
-                    "error": "validation_error",
-                    "message": f"Transfer validation failed. Please ensure the amount ({amount}) is valid with up to 2 decimal places.",
-                    "details": error_msg
-                }
-            
-            print(f"Transfer command failed: {error_msg}")
-            return {"error": error_msg}
-        
-        try:
-            transfer_data = json.loads(result.stdout)
-            return transfer_data
-        except json.JSONDecodeError:
-            print(f"Failed to parse transfer result: {result.stdout}")
-            return {"error": "Failed to parse transfer result", "raw_output": result.stdout}
+        return await run_direct_transfer(amount, recipient, blockchain)
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Transfer execution error: {str(e)}")
         return {"error": str(e)}
 
+BATCH_TRANSFER_CONCURRENCY = int(os.getenv("BATCH_TRANSFER_CONCURRENCY", "4"))
+BATCH_TRANSFER_MAX_ITEMS = int(os.getenv("BATCH_TRANSFER_MAX_ITEMS", "100"))
+BATCH_TRANSFER_MAX_RETRIES = int(os.getenv("BATCH_TRANSFER_MAX_RETRIES", "2"))
+
+def validate_batch_item(item: Any) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
+    """(amount, recipient, blockchain) of a batch item, or why it can't be sent"""
+    if not isinstance(item, dict):
+        return None, "Each transfer must be an object"
+    try:
+        value = round(float(item.get("amount")), 2)
+    except (TypeError, ValueError):
+        value = None
+    # float() also accepts "nan", "inf" and "1e309", which Circle must never see
+    if value is None or not math.isfinite(value) or value <= 0:
+        return None, f"Invalid amount: {item.get('amount')}"
+    amount = str(value)
+    recipient = item.get("recipient")
+    if not isinstance(recipient, str) or not recipient.strip():
+        return None, "Missing recipient"
+    blockchain = str(item.get("blockchain", "ETH")).upper()
+    if blockchain not in CHAIN_NAMES:
+        return None, f"Unsupported blockchain: {item.get('blockchain')}"
+    return {"amount": amount, "recipient": recipient.strip(), "blockchain": blockchain}, None
+
+async def run_batch_item(index: int, item: Any, batch_id: str, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    key = (item.get("idempotency_key") if isinstance(item, dict) else None) or f"{batch_id}:{index}"
+    details, error = validate_batch_item(item)
+    if error:
+        return {"index": index, "idempotency_key": key, "status": "invalid", "error": error}
+    
+    async def send() -> Dict[str, Any]:
+        # Retries reuse the Circle idempotency key, so a transfer that went
+        # through before a 429 or timeout is not sent again
+        async with semaphore:
+            for attempt in range(BATCH_TRANSFER_MAX_RETRIES + 1):
+                transfer_data = await run_direct_transfer(
+                    details["amount"], details["recipient"], details["blockchain"], circle_idempotency_key(key)
+                )
+                if transfer_data.get("error") != "rate_limit":
+                    break
+            return transfer_data
+    
+    try:
+        transfer_data, duplicate = await transfer_idempotency.run(key, details, send, transfer_succeeded)
+    except IdempotencyConflict as e:
+        return {"index": index, "idempotency_key": key, "status": "conflict", "error": str(e), **details}
+    except HTTPException as e:
+        # Shed by admission control; safe to retry with the same key
+        transfer_data, duplicate = {"error": "overloaded", "message": e.detail}, False
+    except Exception as e:
+        print(f"Batch transfer {key} error: {str(e)}")
+        transfer_data, duplicate = {"error": str(e)}, False
+    
+    return {
+        "index": index,
+        "idempotency_key": key,
+        "status": "sent" if transfer_succeeded(transfer_data) else "failed",
+        "duplicate": duplicate,
+        **details,
+        "result": transfer_data
+    }
+
+@app.post("/execute_batch_transfers")
+async def execute_batch_transfers(request: dict):
+    """Send many direct transfers with bounded concurrency.
+
+    Body: {"transfers": [{"amount", "recipient", "blockchain", "idempotency_key"?}],
+    "batch_id"?, "max_concurrency"?}. Items without an idempotency key get
+    "<batch_id>:<index>". Resubmitting the batch with the same keys (or
+    batch_id) replays items that were sent and retries only the failed ones.
+    """
+    transfers = request.get("transfers")
+    if not isinstance(transfers, list) or not transfers:
+        raise HTTPException(status_code=400, detail="transfers must be a non-empty list")
+    if len(transfers) > BATCH_TRANSFER_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_TRANSFER_MAX_ITEMS} transfers per batch")
+    
+    batch_id = str(request.get("batch_id") or uuid.uuid4())
+    try:
+        max_concurrency = int(request.get("max_concurrency", BATCH_TRANSFER_CONCURRENCY))
+    except (TypeError, ValueError):
+        max_concurrency = BATCH_TRANSFER_CONCURRENCY
+    semaphore = asyncio.Semaphore(max(1, min(max_concurrency, BATCH_TRANSFER_CONCURRENCY)))
+    
+    results = await asyncio.gather(*[
+        run_batch_item(index, item, batch_id, semaphore) for index, item in enumerate(transfers)
+    ])
+    
+    summary = {status: 0 for status in ("sent", "failed", "invalid", "conflict")}
+    for result in results:
+        summary[result["status"]] += 1
+    
+    last_sent = next((result for result in reversed(results) if result["status"] == "sent"), None)
+    if last_sent:
+        update_context({
+            "amount": last_sent["amount"],
+            "recipient": last_sent["recipient"],
+            "blockchain": last_sent["blockchain"]
+        }, "direct_transfer", request.get("session_id", DEFAULT_SESSION_ID))
+    
+    return {
+        "batch_id": batch_id,
+        "success": summary["sent"] == len(results),
+        "summary": summary,
+        "results": results
+    }
+
 @app.post("/check_transfer_status")
 async def check_transfer_status(request: dict):
     """Check the status of a transfer"""
@@ -458,60 +3322,150 @@ async def check_transfer_status(request: dict):
         if not transfer_id:
             return {"error": "No transfer ID provided"}
         
-        # Use the circleHandler.js script
-        command = f"node circle/circleHandler.js {transfer_id}"
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, cwd=os.path.expanduser("~/agentkit"))
-        
-        if result.returncode != 0:
-            error_msg = result.stderr or result.stdout
-            if "429" in error_msg or "rate limit" in error_msg.lower():
-                return {
-                    "status": "rate_limit",
-                    "message": "Rate limit reached while checking status. Please try again in a moment."
-                }
-            return {"error": error_msg}
-        
-        try:
-            # Extract JSON from output that may have debug lines
-            lines = result.stdout.strip().split('\n')
-            json_str = None
-            
-            # Find the last line that looks like JSON
-            for line in reversed(lines):
-                line = line.strip()
-                if line.startswith('{') and line.endswith('}'):
-                    json_str = line
-                    break
-            
-            if json_str:
-                status_data = json.loads(json_str)
-            else:
-                raise json.JSONDecodeError("No JSON found", result.stdout, 0)
-            
-            return status_data
-        except json.JSONDecodeError:
-            return {"error": "Failed to parse status result", "raw_output": result.stdout}
+        # Duplicate polls share one circleHandler.js lookup
+        return await transfer_status_service.get_status(transfer_id)
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Status check error: {str(e)}")
         return {"error": str(e)}
 
+@app.get("/transfer_status_stream/{transfer_id}")
+async def transfer_status_stream(transfer_id: str):
+    """Server-sent `status` events for a transfer until it completes, then `end`"""
+    queue = transfer_watcher.subscribe(transfer_id)
+    
+    async def events():
+        try:
+            while True:
+                try:
+                    update = await asyncio.wait_for(queue.get(), 15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                if update is None:
+                    yield sse_event("end", {"transferId": transfer_id})
+                    return
+                yield sse_event("status", update)
+        finally:
+            transfer_watcher.unsubscribe(transfer_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics: per-stage latency histograms and Circle error counters"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admission_stats")
+async def admission_stats():
+    """Active, queued and rejected requests per dependency"""
+    return {
+        limiter.name: limiter.stats()
+        for limiter in (openai_limiter, *circle_limiters.values())
+    }
+
+@app.get("/transfer_status_stats")
+async def transfer_status_stats():
+    """Coalescing, cache and rate limiter counters for status checks"""
+    return transfer_status_service.stats()
+
+@app.get("/llm_cache_stats")
+async def llm_cache_stats():
+    """Hit/miss counters for the LLM response cache"""
+    return llm_cache.stats()
+
+@app.post("/llm_cache_clear")
+async def llm_cache_clear():
+    """Drop all cached LLM responses"""
+    llm_cache.clear()
+    return {"message": "LLM cache cleared"}
+
+@app.get("/proof_cache_stats")
+async def proof_cache_stats():
+    """Hit/miss counters for verified proof reuse"""
+    return proof_cache.stats()
+
+@app.get("/step_size_plan")
+async def step_size_plan(function: str = "prove_kyc"):
+    """Planned step_size and the observed time/size trade-off for a proof function"""
+    if function not in PROOF_WASM_FILES:
+        raise HTTPException(status_code=404, detail=f"Unknown proof function: {function}")
+    arguments = PROOF_ARGUMENTS[function]
+    name = wasm_name(PROOF_WASM_FILES[function])
+    return {
+        "function": function,
+        "wasm": name,
+        "argument_pattern": argument_pattern(arguments),
+        "objective": step_size_planner.objective,
+        "step_size": step_size_planner.plan(name, arguments),
+        "curve": step_size_planner.curve(name, arguments)
+    }
+
+@app.get("/proofs")
+async def list_proofs(function: Optional[str] = None, status: Optional[str] = None,
+                      since: Optional[str] = None, until: Optional[str] = None,
+                      file_hash: Optional[str] = None, limit: int = 50, offset: int = 0):
+    """Paginated proofs, newest first; `since=today` lists today's proofs"""
+    return proof_registry.list_proofs(function, status, parse_since(since), until, file_hash, limit, offset)
+
+@app.get("/proofs/latest")
+async def latest_proof(function: Optional[str] = None, verified: bool = False):
+    """Most recent complete proof, optionally of one function and verified"""
+    proof = proof_registry.latest_proof(function, verified)
+    if proof is None:
+        raise HTTPException(status_code=404, detail="No matching proof")
+    return proof
+
+@app.get("/proofs/{proof_id}")
+async def get_proof(proof_id: str):
+    proof = proof_registry.get_proof(proof_id)
+    if proof is None:
+        raise HTTPException(status_code=404, detail=f"Unknown proof: {proof_id}")
+    return proof
+
+@app.get("/verifications")
+async def list_verifications(proof_id: Optional[str] = None, is_valid: Optional[bool] = None,
+                             since: Optional[str] = None, limit: int = 50, offset: int = 0):
+    """Paginated verifications, newest first"""
+    return proof_registry.list_verifications(proof_id, is_valid, parse_since(since), limit, offset)
+
 @app.get("/context")
-async def get_context():
-    """Get current conversation context (for debugging)"""
-    return conversation_context
+async def get_context(session_id: str = DEFAULT_SESSION_ID):
+    """Get conversation context for a session (for debugging)"""
+    return conversation_store.snapshot(session_id)
 
 @app.post("/reset_context")
-async def reset_context():
-    """Reset conversation context"""
-    global conversation_context
-    conversation_context = {
-        "last_transfer": None,
-        "last_proof_type": None,
-        "conversation_history": []
-    }
+async def reset_context(session_id: str = DEFAULT_SESSION_ID):
+    """Reset conversation context for a session"""
+    conversation_store.reset(session_id)
     return {"message": "Context reset successfully"}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    
+    workers = int(os.getenv("SERVICE_WORKERS", "1"))
+    if workers > 1:
+        # Follow-ups like "do the same on solana" may land on any worker
+        if not conversation_store.shared:
+            raise SystemExit("SERVICE_WORKERS > 1 needs CONTEXT_BACKEND=sqlite or CONTEXT_BACKEND=shm")
+        uvicorn.run(
+            "langchain_service:app",
+            host="0.0.0.0",
+            port=8002,
+            workers=workers,
+            app_dir=os.path.dirname(os.path.abspath(__file__))
+        )
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8002)
+    
+    # The launcher created the shared context table, so it removes it
+    if isinstance(conversation_store, SharedMemoryContextBackend):
+        conversation_store.close()
+        conversation_store.shm.unlink()
@@ -144,6 +144,10 @@ async fn process_user_command(state: AppState, message: String) {
         }
     };
 
+    // The UI sends {"message", "session_id"}; /chat keeps a conversation
+    // context per session, and transfers run here must update the same one
+    let session_id = payload.get("session_id").and_then(|s| s.as_str()).map(|s| s.to_string());
+
     let client = reqwest::Client::new();
     let res = client
         .post(&format!("{}/chat", state.langchain_url))
@@ -153,7 +157,7 @@ async fn process_user_command(state: AppState, message: String) {
 
     match res {
         Ok(response) => {
-            if let Ok(chat_response) = response.json::<serde_json::Value>().await {
+            if let Ok(mut chat_response) = response.json::<serde_json::Value>().await {
                 // Debug: Log the entire response
                 info!("Chat response received: {:?}", chat_response);
                 
@@ -164,46 +168,42 @@ async fn process_user_command(state: AppState, message: String) {
                     info!("No intent found in response");
                 }
 
+                // Direct transfers in a multi-action message have no intent; tag
+                // each with the id its transfer updates will carry so the UI
+                // can show a card for it straight away
+                if let Some(intents) = chat_response.get_mut("intents").and_then(|i| i.as_array_mut()) {
+                    for entry in intents.iter_mut() {
+                        if let Some(metadata) = entry.get_mut("metadata").and_then(|m| m.as_object_mut()) {
+                            if metadata.get("action").and_then(|a| a.as_str()) == Some("direct_transfer") {
+                                metadata.insert("transfer_id".to_string(), json!(format!("transfer_{}", Uuid::new_v4())));
+                            }
+                        }
+                    }
+                }
+
                 // Send the response to the UI
                 let ui_message = json!({
                     "type": "chat_response",
                     "response": chat_response.get("response").and_then(|r| r.as_str()).unwrap_or(""),
-                    "metadata": chat_response.get("metadata")
+                    "metadata": chat_response.get("metadata"),
+                    "intents": chat_response.get("intents")
                 });
                 
                 if state.tx.send(ui_message.to_string()).is_err() {
                     error!("Failed to broadcast message to clients");
                 }
                 
-                // Check for an intent and route to appropriate handler
-                if let Some(intent_val) = chat_response.get("intent") {
-                    if let Ok(metadata) = serde_json::from_value::<ProofMetadata>(intent_val.clone()) {
-                        let proof_id = chat_response.get("metadata")
-                            .and_then(|m| m.get("proof_id"))
-                            .and_then(|pid| pid.as_str())
-                            .unwrap_or(&Uuid::new_v4().to_string())
-                            .to_string();
-                        
-                        // Check if this is a verification request
-                        if let Some(context) = &metadata.additional_context {
-                            if context.get("is_verification").and_then(|v| v.as_bool()).unwrap_or(false) {
-                                // This is a manual verification request
-                                info!("Processing manual verification for {}", proof_id);
-                                tokio::spawn(verify_proof(state.clone(), proof_id, metadata));
-                                return;
-                            }
-                        }
-                        
-                        // Check if this is a list request
-                        if metadata.function == "list_proofs" {
-                            info!("Processing list proofs request");
-                            tokio::spawn(list_proofs(state.clone(), metadata));
-                            return;
+                // Multi-action messages list every intent; run them concurrently
+                if let Some(intents) = chat_response.get("intents").and_then(|i| i.as_array()) {
+                    for entry in intents {
+                        match entry.get("intent").filter(|i| !i.is_null()) {
+                            Some(intent_val) => dispatch_intent(&state, intent_val, entry.get("metadata")),
+                            None => dispatch_direct_transfer(&state, entry.get("metadata"), session_id.clone()),
                         }
-                        
-                        // Otherwise, generate a new proof
-                        tokio::spawn(generate_proof(state.clone(), proof_id, metadata));
                     }
+                } else if let Some(intent_val) = chat_response.get("intent") {
+                    // Check for an intent and route to appropriate handler
+                    dispatch_intent(&state, intent_val, chat_response.get("metadata"));
                 }
             }
         }
@@ -218,6 +218,53 @@ async fn process_user_command(state: AppState, message: String) {
     }
 }
 
+fn dispatch_intent(state: &AppState, intent_val: &serde_json::Value, response_metadata: Option<&serde_json::Value>) {
+    if let Ok(metadata) = serde_json::from_value::<ProofMetadata>(intent_val.clone()) {
+        let proof_id = response_metadata
+            .and_then(|m| m.get("proof_id"))
+            .and_then(|pid| pid.as_str())
+            .unwrap_or(&Uuid::new_v4().to_string())
+            .to_string();
+        
+        // Check if this is a verification request
+        if let Some(context) = &metadata.additional_context {
+            if context.get("is_verification").and_then(|v| v.as_bool()).unwrap_or(false) {
+                // This is a manual verification request
+                info!("Processing manual verification for {}", proof_id);
+                tokio::spawn(verify_proof(state.clone(), proof_id, metadata));
+                return;
+            }
+        }
+        
+        // Check if this is a list request
+        if metadata.function == "list_proofs" {
+            info!("Processing list proofs request");
+            tokio::spawn(list_proofs(state.clone(), metadata));
+            return;
+        }
+        
+        // Otherwise, generate a new proof
+        tokio::spawn(generate_proof(state.clone(), proof_id, metadata));
+    }
+}
+
+fn dispatch_direct_transfer(state: &AppState, metadata: Option<&serde_json::Value>, session_id: Option<String>) {
+    let metadata = match metadata {
+        Some(metadata) => metadata,
+        None => return,
+    };
+    if metadata.get("action").and_then(|a| a.as_str()) != Some("direct_transfer") {
+        return;
+    }
+    let transfer_id = metadata.get("transfer_id")
+        .and_then(|t| t.as_str())
+        .map(|t| t.to_string())
+        .unwrap_or_else(|| format!("transfer_{}", Uuid::new_v4()));
+    let details = metadata.get("details").cloned().unwrap_or_else(|| json!({}));
+    info!("Processing direct transfer {}", transfer_id);
+    tokio::spawn(execute_direct_transfer(state.clone(), transfer_id, details, session_id));
+}
+
 // --- Proof Generation ---
 
 async fn generate_proof(state: AppState, proof_id: String, metadata: ProofMetadata) {
@@ -305,6 +352,15 @@ async fn generate_proof(state: AppState, proof_id: String, metadata: ProofMetada
                             .map(|m| m.len())
                             .unwrap_or(0);
                         
+                        // The AI service plans future step sizes from these
+                        let metrics = json!({
+                            "generation_time_secs": duration.as_secs_f64(),
+                            "file_size_mb": proof_size as f64 / (1024.0 * 1024.0)
+                        });
+                        if let Err(e) = std::fs::write(proof_dir.join("metrics.json"), metrics.to_string()) {
+                            error!("Failed to save proof metrics: {}", e);
+                        }
+                        
                         let success_msg = json!({
                             "type": "proof_complete",
                             "proof_id": proof_id,
@@ -606,3 +662,71 @@ async fn execute_transfer(state: AppState, proof_id: String, context: serde_json
         }
     }
 }
+
+async fn execute_direct_transfer(state: AppState, transfer_id: String, details: serde_json::Value, session_id: Option<String>) {
+    info!("Executing direct transfer {}", transfer_id);
+    
+    let status_msg = json!({
+        "type": "transfer_status",
+        "transfer_id": transfer_id,
+        "status": "executing",
+        "message": "Executing direct USDC transfer..."
+    });
+    let _ = state.tx.send(status_msg.to_string());
+    
+    let mut request = json!({
+        "amount": details.get("amount"),
+        "recipient": details.get("recipient"),
+        "blockchain": details.get("blockchain")
+    });
+    // Without one the Python service falls back to its default session
+    if let Some(session_id) = session_id {
+        request["session_id"] = json!(session_id);
+    }
+    
+    let client = reqwest::Client::new();
+    let res = client
+        .post(&format!("{}/execute_direct_transfer", state.langchain_url))
+        .json(&request)
+        .send()
+        .await;
+    
+    match res {
+        Ok(response) => {
+            if let Ok(transfer_result) = response.json::<serde_json::Value>().await {
+                // Circle failures come back as {"error": ...}, overload as an
+                // HTTP error with a "detail"
+                let error = transfer_result.get("error").or_else(|| transfer_result.get("detail"));
+                
+                if error.is_none() {
+                    let complete_msg = json!({
+                        "type": "transfer_complete",
+                        "transfer_id": transfer_id,
+                        "status": "complete",
+                        "result": transfer_result
+                    });
+                    let _ = state.tx.send(complete_msg.to_string());
+                } else {
+                    let err_msg = json!({
+                        "type": "transfer_error",
+                        "transfer_id": transfer_id,
+                        "error": transfer_result.get("message")
+                            .and_then(|m| m.as_str())
+                            .or_else(|| error.and_then(|e| e.as_str()))
+                            .unwrap_or("Transfer failed")
+                    });
+                    let _ = state.tx.send(err_msg.to_string());
+                }
+            }
+        }
+        Err(e) => {
+            error!("Failed to execute direct transfer: {}", e);
+            let err_msg = json!({
+                "type": "transfer_error",
+                "transfer_id": transfer_id,
+                "error": format!("Failed to execute transfer: {}", e)
+            });
+            let _ = state.tx.send(err_msg.to_string());
+        }
+    }
+}